@@ -53,3 +53,69 @@ class InvalidGivenPointsArchivedData(APIException):
     status_code = 400
     default_detail = "The data of a given point is malformed"
     default_code = 'bad_request'
+
+
+class InvalidWeekException(APIException):
+    status_code = 400
+    default_detail = "A week must follow the YYYY-MM-DD format"
+    default_code = 'bad_request'
+
+
+class TenantLockedException(APIException):
+    status_code = 503
+    default_detail = "The data of this team is being moved, try again in a few seconds"
+    default_code = 'service_unavailable'
+
+
+class FinalPointDistributionException(APIException):
+    status_code = 400
+    default_detail = "The point distribution of this week has already been validated"
+    default_code = 'bad_request'
+
+
+class PointsAlreadySentException(APIException):
+    status_code = 400
+    default_detail = "A member already sent points this week"
+    default_code = 'bad_request'
+
+
+class InvalidRequestBodyException(APIException):
+    status_code = 400
+    default_detail = "The body of the request must be a JSON object"
+    default_code = 'bad_request'
+
+
+class InvalidProfileQueryException(APIException):
+    status_code = 400
+    default_detail = "limit and top must be whole numbers, zero or more"
+    default_code = 'bad_request'
+
+
+class IdempotencyKeyInProgressException(APIException):
+    status_code = 409
+    default_detail = "A request with this Idempotency-Key is still being processed"
+    default_code = 'conflict'
+
+
+class IdempotencyKeyReusedException(APIException):
+    status_code = 422
+    default_detail = "This Idempotency-Key was already used for a different request"
+    default_code = 'unprocessable_entity'
+
+
+class DependencyUnavailableException(APIException):
+    status_code = 503
+    default_detail = "A service this request depends on is unavailable, try again later"
+    default_code = 'service_unavailable'
+
+
+class InvalidBatchException(APIException):
+    status_code = 400
+    default_detail = "A batch must be a list of distributions, each with its given_points, date and instance_id"
+    default_code = 'bad_request'
+
+
+class TruncateDisabledException(APIException):
+    status_code = 403
+    default_detail = "Deleting the data of every team is disabled, give the instance_id of the team to delete"
+    default_code = 'permission_denied'
@@ -0,0 +1,110 @@
+import datetime
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction, router
+from django.utils import timezone
+
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .exceptions import IdempotencyKeyInProgressException, IdempotencyKeyReusedException, \
+    InvalidRequestBodyException
+from .models import IdempotencyKey
+from .utils import concatenate_and_hash
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+def get_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return concatenate_and_hash(request.method + request.path, body)
+
+
+def get_expiry_horizon():
+    return timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+
+
+def take_over(record):
+    """
+    Claim a key whose request never stored its response, e.g. its worker was killed. A claim older than
+    IDEMPOTENCY_LEASE_SECONDS is stale, only one retry can take it over.
+    """
+    lease_start = timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+    if record.created >= lease_start:
+        return False
+    return IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True, created=record.created)\
+        .update(created=timezone.now()) == 1
+
+
+def claim_key(instance_id, key, fingerprint):
+    """
+    Return the stored record of a key, or None after claiming the key for this request
+    """
+    record = IdempotencyKey.objects.filter(instance_id=instance_id, key=key).first()
+    if record is not None and record.created < get_expiry_horizon():
+        record.delete()
+        record = None
+    if record is None:
+        try:
+            with transaction.atomic(using=router.db_for_write(IdempotencyKey)):
+                IdempotencyKey.objects.create(instance_id=instance_id, key=key, fingerprint=fingerprint)
+            return None
+        except IntegrityError:
+            # A concurrent request claimed it first
+            record = IdempotencyKey.objects.get(instance_id=instance_id, key=key)
+    if record.fingerprint != fingerprint:
+        raise IdempotencyKeyReusedException()
+    if record.status_code is None:
+        if take_over(record):
+            return None
+        raise IdempotencyKeyInProgressException()
+    return record
+
+
+def store_response(keys, status_code, data):
+    """
+    Keep the final answer to the key, any status under 500 whether the view returned it or raised it. Server errors
+    are not stored, the key is released and a retry runs the request again.
+    """
+    if status_code >= 500:
+        keys.delete()
+    else:
+        keys.update(status_code=status_code, body=json.dumps(data, cls=JSONEncoder))
+
+
+def idempotent(func):
+    """
+    Replay the stored response of a request sent again with the same Idempotency-Key header instead of running it
+    again. Keys are scoped to the tenant and expire after IDEMPOTENCY_KEY_TTL_SECONDS.
+    """
+    @wraps(func)
+    def inner(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER, '')
+        if key == '':
+            return func(self, request, *args, **kwargs)
+        if not isinstance(request.data, dict):
+            raise InvalidRequestBodyException()
+        instance_id = request.data.get('instance_id', '')
+        record = claim_key(instance_id, key, get_fingerprint(request))
+        if record is not None:
+            response = Response(json.loads(record.body), status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        keys = IdempotencyKey.objects.filter(instance_id=instance_id, key=key)
+        try:
+            response = func(self, request, *args, **kwargs)
+        except APIException as e:
+            # The body rest_framework answers with
+            data = e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail}
+            store_response(keys, e.status_code, data)
+            raise
+        except Exception:
+            keys.delete()
+            raise
+        store_response(keys, response.status_code, response.data)
+        return response
+    return inner
@@ -0,0 +1,103 @@
+from logging.handlers import QueueHandler, QueueListener
+
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through only a share of the records below WARNING, the others are always kept
+    """
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands the records to a queue, a thread of the process formats and writes them to stdout. When the queue is full
+    the records are dropped instead of blocking the request.
+    """
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(sys.stdout)
+        self.listener = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+        self.dropped = 0
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def start(self):
+        """
+        The listener thread of a parent process does not survive a fork, e.g. the preloading gunicorn master
+        """
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self.listener = QueueListener(self.queue, self.target)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.pid = None
+
+    def prepare(self, record):
+        # Merge the arguments now, they may change once the request goes on
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import FastJSONRenderer, orjson
+from core.utils import concatenate_and_hash
+
+import time
+
+
+def build_history(distributions, members):
+    """
+    Payload shaped like the PointDistributionHistory response, plus a datetime and a decimal per distribution
+    """
+    monday = date(2017, 1, 2)
+    emails = ['member{}@email.com'.format(i) for i in range(members)]
+    history = []
+    for i in range(distributions):
+        week = (monday + timedelta(weeks=i)).isoformat()
+        given_points = [OrderedDict([('from_member', from_member), ('to_member', to_member),
+                                     ('points', 100 // members), ('week', week), ('instance_id', '1234')])
+                        for from_member in emails for to_member in emails]
+        history.append(OrderedDict([('identifier', concatenate_and_hash(week, '1234')), ('week', week),
+                                    ('date', week), ('is_final', True), ('instance_id', '1234'),
+                                    ('modified', timezone.now()), ('average', Decimal('10.5')),
+                                    ('given_points', given_points)]))
+    return history
+
+
+class Command(BaseCommand):
+    help = 'Compare the encode throughput of the JSON renderers on a history payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--distributions', type=int, default=52)
+        parser.add_argument('--members', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write('orjson is not installed, FastJSONRenderer falls back to the standard library')
+
+        payload = build_history(options['distributions'], options['members'])
+        outputs = []
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                output = renderer.render(payload)
+            elapsed = (time.perf_counter() - start) / options['repeat']
+            outputs.append(output)
+            self.stdout.write('%-18s %8.2f ms per payload  %8.1f MB/s' % (
+                type(renderer).__name__, elapsed * 1000, len(output) / elapsed / 2 ** 20))
+
+        if outputs[0] != outputs[1]:
+            raise CommandError('The renderers do not produce the same bytes')
+        self.stdout.write('Identical output, %s bytes' % len(outputs[0]))
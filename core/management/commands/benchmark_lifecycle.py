@@ -0,0 +1,224 @@
+from datetime import date
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from core import metrics, outbound
+from core.models import TenantDataVersion, TenantShard
+from core.points_operation import get_valid_point_values
+from core.purge import purge_tenant
+from core.utils import get_monday_from_date, DATE_PATTERN
+
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import time
+
+import requests
+
+
+class StandInAdapter(requests.adapters.BaseAdapter):
+    """
+    Answers the calls to the token storage, VSTS and Slackbot locally, after the given latency
+    """
+    def __init__(self, members_count, latency):
+        super().__init__()
+        self.members_count = members_count
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        time.sleep(self.latency)
+        url = urlparse(request.url)
+        status, data = 200, None
+        if url.path.endswith('/tokenstorage'):
+            data = {'vsts_token': 'token'}
+        elif url.path.endswith('/_apis/projects'):
+            data = {'value': [{'id': 'project'}]}
+        elif url.path.endswith('/teams'):
+            data = {'value': [{'id': 'team'}]}
+        elif url.path.endswith('/members'):
+            instance_name = url.hostname.split('.')[0]
+            data = {'value': [{'uniqueName': get_email(i, instance_name), 'displayName': 'Member {}'.format(i)}
+                              for i in range(self.members_count)]}
+        else:
+            status = 202
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode() if data is not None else b''
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def get_email(index, instance_name):
+    return 'member{}@{}.com'.format(index, instance_name)
+
+
+def get_host():
+    """
+    A host the requests are accepted for, any will do with a wildcard
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if '*' not in host and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of sorted values
+    """
+    return values[max(int(math.ceil(percent / 100 * len(values))) - 1, 0)]
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Run the weekly lifecycle of a number of teams through the whole middleware and view stack: member ' \
+           'import, every member sending then editing points, validation and the reads. The token storage, VSTS ' \
+           'and Slackbot are answered locally. Prints the latency percentiles, throughput and queries per request ' \
+           'of every endpoint as JSON. The teams are deleted afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teams', type=int, default=5)
+        parser.add_argument('--members', type=int, default=10, help='members per team, at most 14')
+        parser.add_argument('--reads', type=int, default=5, help='times the reads are repeated per member')
+        parser.add_argument('--latency', type=float, default=0, help='seconds each outbound call takes')
+        parser.add_argument('--output', default='-', help='file to write the JSON to, stdout by default')
+
+    def handle(self, *args, **options):
+        try:
+            self.values = get_valid_point_values(options['members'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.client = Client(HTTP_HOST=get_host())
+        self.samples = {}
+        adapter = StandInAdapter(options['members'], options['latency'])
+        for dependency in settings.OUTBOUND_DEPENDENCIES:
+            outbound.get_session(dependency).mount('http://', adapter)
+            outbound.get_session(dependency).mount('https://', adapter)
+
+        instance_ids = ['benchmark-lifecycle-{}-{}'.format(os.getpid(), i) for i in range(options['teams'])]
+        # The debug and info records would be written to stdout along with the results
+        logging.disable(logging.INFO)
+        start = time.perf_counter()
+        try:
+            for instance_id in instance_ids:
+                self.run_lifecycle(instance_id, options['members'], options['reads'])
+            duration = time.perf_counter() - start
+        finally:
+            logging.disable(logging.NOTSET)
+            for dependency in settings.OUTBOUND_DEPENDENCIES:
+                outbound._sessions.pop(dependency, None)
+            self.delete_teams(instance_ids)
+
+        results = self.summarize(duration)
+        results.update({
+            'revision': get_revision(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'teams': options['teams'],
+            'members': options['members'],
+            'reads': options['reads'],
+            'latency': options['latency'],
+        })
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+    def call(self, method, path, data=None):
+        start = time.perf_counter()
+        if data is None:
+            response = getattr(self.client, method)(path)
+        else:
+            response = getattr(self.client, method)(path, json.dumps(data), content_type='application/json')
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise CommandError('%s %s answered %s: %s' % (method.upper(), path, response.status_code,
+                                                          response.content.decode()))
+        request = response.wsgi_request
+        name = '{} {}'.format(metrics.get_view_name(request), request.method)
+        self.samples.setdefault(name, []).append((elapsed, request.metrics.queries))
+        return response
+
+    def run_lifecycle(self, instance_id, members_count, reads):
+        today = date.today().strftime(DATE_PATTERN)
+        week = get_monday_from_date(today, DATE_PATTERN)
+        emails = [get_email(i, instance_id) for i in range(members_count)]
+
+        self.call('get', '/v1/members/?instance_id={0}&instance_name={0}&user_email={1}'.format(
+            instance_id, emails[0]))
+
+        def given_points(from_member, values):
+            return {
+                'given_points': [{'from_member': from_member, 'to_member': to_member, 'points': points,
+                                  'instance_id': instance_id} for to_member, points in zip(emails, values)],
+                'date': today,
+                'instance_id': instance_id,
+            }
+
+        for email in emails:
+            self.call('post', '/v1/points/distribution/send/', given_points(email, self.values))
+        # Everybody changes their mind the same way, the distribution stays valid
+        edited = self.values[::-1]
+        for email in emails:
+            self.call('put', '/v1/points/distribution/send/', given_points(email, edited))
+        self.call('put', '/v1/points/distribution/validate/', {'week': week, 'instance_id': instance_id})
+
+        for _ in range(reads):
+            self.call('get', '/v1/teams/team/?instance_id={}'.format(instance_id))
+            self.call('get', '/v1/team/points/?instance_id={}'.format(instance_id))
+            self.call('get', '/v1/points/distribution/history/?instance_id={}'.format(instance_id))
+            self.call('get', '/v1/points/distribution/{}/?instance_id={}'.format(week, instance_id))
+            for email in emails:
+                self.call('get', '/v1/member/history/{}/?instance_id={}'.format(email, instance_id))
+
+    def summarize(self, duration):
+        endpoints = {}
+        for name, samples in self.samples.items():
+            latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+            queries = [count for _, count in samples]
+            endpoints[name] = {
+                'requests': len(samples),
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'mean_ms': sum(latencies) / len(latencies),
+                'queries_per_request': sum(queries) / len(queries),
+                'max_queries': max(queries),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'requests': total,
+            'duration_s': duration,
+            'throughput_rps': total / duration,
+            'endpoints': endpoints,
+        }
+
+    def delete_teams(self, instance_ids):
+        for database in settings.TENANT_SHARDS:
+            for instance_id in instance_ids:
+                purge_tenant(instance_id, database)
+            TenantDataVersion.objects.using(database).filter(instance_id__in=instance_ids).delete()
+        TenantShard.objects.using('default').filter(instance_id__in=instance_ids).delete()
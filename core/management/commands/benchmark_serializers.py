@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, router
+
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Member, PointDistribution, GivenPoint, GivenPointArchived
+from core.serializers import MemberSerializer, GivenPointArchivedSerializer, PointDistributionSerializer, \
+    MemberValuesSerializer, GivenPointArchivedValuesSerializer, PointDistributionValuesSerializer
+from core.utils import concatenate_and_hash, GIVEN_POINTS_PREFETCH
+
+import time
+
+INSTANCE_ID = 'benchmark-serializers'
+
+
+def create_rows(weeks, members_count):
+    Member.objects.bulk_create([
+        Member(email='member{}@email.com'.format(i), name='Member {}'.format(i), instance_id=INSTANCE_ID,
+               identifier=concatenate_and_hash('member{}@email.com'.format(i), INSTANCE_ID))
+        for i in range(members_count)
+    ])
+    members = list(Member.objects.filter(instance_id=INSTANCE_ID))
+    monday = date(2017, 1, 2)
+    for i in range(weeks):
+        week = monday + timedelta(weeks=i)
+        distribution = PointDistribution.objects.create(identifier=concatenate_and_hash(week, INSTANCE_ID), week=week,
+                                                        date=week, is_final=True, instance_id=INSTANCE_ID)
+        GivenPoint.objects.bulk_create([
+            GivenPoint(from_member=member, to_member=member, points=100, point_distribution=distribution, week=week,
+                       instance_id=INSTANCE_ID) for member in members
+        ])
+        GivenPointArchived.objects.bulk_create([
+            GivenPointArchived(from_member=from_member, to_member=to_member, points=100 // members_count, week=week,
+                               instance_id=INSTANCE_ID) for from_member in members for to_member in members
+        ])
+
+
+class Command(BaseCommand):
+    help = 'Compare the per row cost of the model serializers with the values serializers of the read endpoints. ' \
+           'The rows are created in a transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=52)
+        parser.add_argument('--members', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=router.db_for_write(GivenPointArchived)):
+            create_rows(options['weeks'], options['members'])
+            members = Member.objects.filter(instance_id=INSTANCE_ID)
+            archived = GivenPointArchived.objects.filter(instance_id=INSTANCE_ID)
+            distributions = PointDistribution.objects.filter(instance_id=INSTANCE_ID)
+            given_points = GivenPoint.objects.filter(instance_id=INSTANCE_ID)
+            cases = (
+                ('Member', members.count(),
+                 lambda: MemberSerializer(members.all(), many=True),
+                 lambda: MemberValuesSerializer(members.all(), many=True)),
+                ('GivenPointArchived', archived.count(),
+                 lambda: GivenPointArchivedSerializer(archived.select_related('from_member', 'to_member'), many=True),
+                 lambda: GivenPointArchivedValuesSerializer(archived.all(), many=True)),
+                ('PointDistribution', given_points.count(),
+                 lambda: PointDistributionSerializer(distributions.prefetch_related(*GIVEN_POINTS_PREFETCH),
+                                                     many=True),
+                 lambda: PointDistributionValuesSerializer(distributions.all(), many=True)),
+            )
+            for name, rows, *serializers in cases:
+                timings = []
+                outputs = []
+                for get_serializer in serializers:
+                    start = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        data = get_serializer().data
+                    timings.append((time.perf_counter() - start) / options['repeat'] / rows)
+                    outputs.append(JSONRenderer().render(data))
+                if outputs[0] != outputs[1]:
+                    raise CommandError('The serializers of %s do not produce the same output' % name)
+                self.stdout.write('%-20s %6s rows  model %7.1f us/row  values %7.1f us/row' % (
+                    name, rows, timings[0] * 10 ** 6, timings[1] * 10 ** 6))
+            transaction.set_rollback(True)
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import os
+import subprocess
+import sys
+import time
+
+CONFIG_PATH = os.path.join(settings.BASE_DIR, 'pointdistribution', 'gunicorn_conf.py')
+RUN_GUNICORN = 'from gunicorn.app.wsgiapp import run; run()'
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of the default gunicorn server with the bundled gunicorn config'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/v1/teams/all/', help='endpoint to request')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--port', type=int, default=8100)
+
+    def handle(self, *args, **options):
+        url = 'http://127.0.0.1:{}{}'.format(options['port'], options['path'])
+        results = []
+        for name, config in (('default', []), ('gunicorn_conf', ['-c', CONFIG_PATH])):
+            server = subprocess.Popen([sys.executable, '-c', RUN_GUNICORN] + config +
+                                      ['-b', '127.0.0.1:{}'.format(options['port']), 'pointdistribution.wsgi'],
+                                      cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                self.wait_until_ready(url, server)
+                throughput, errors = self.measure(url, options['requests'], options['concurrency'])
+            finally:
+                server.terminate()
+                server.wait()
+            results.append(throughput)
+            self.stdout.write('%-14s %8.1f requests/s  %s errors' % (name, throughput, errors))
+        self.stdout.write('Speedup: %.2fx' % (results[1] / results[0]))
+
+    def wait_until_ready(self, url, server, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn exited with status %s' % server.returncode)
+            try:
+                urlopen(url).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError('gunicorn did not answer within %s seconds' % timeout)
+
+    def measure(self, url, requests, concurrency):
+        def fetch(_):
+            try:
+                urlopen(url).close()
+                return True
+            except OSError:
+                return False
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            succeeded = sum(executor.map(fetch, range(requests)))
+        return requests / (time.time() - start), requests - succeeded
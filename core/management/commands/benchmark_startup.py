@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+import subprocess
+import sys
+
+# Run in a fresh interpreter: loads the WSGI app and the URLconf like a worker does before its first request, the
+# time spent in each import is attributed to the module it loaded (core and pointdistribution per module, the
+# others per package)
+MEASURE_STARTUP = '''
+import builtins, json, sys, time
+
+imports = {}
+children = [0.0]
+original_import = builtins.__import__
+
+
+def absolute_name(name, globals, level):
+    if level == 0 or not globals:
+        return name
+    package = globals.get('__package__') or globals['__name__'].rpartition('.')[0]
+    base = package.rsplit('.', level - 1)[0]
+    return base + '.' + name if name else base
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    before = len(sys.modules)
+    children.append(0.0)
+    start = time.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        own = elapsed - children.pop()
+        children[-1] += elapsed
+        if len(sys.modules) > before:
+            module = absolute_name(name, globals, level)
+            if module.split('.')[0] not in ('core', 'pointdistribution'):
+                module = module.split('.')[0]
+            imports[module] = imports.get(module, 0.0) + own
+
+
+builtins.__import__ = timed_import
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+total = time.perf_counter() - start
+builtins.__import__ = original_import
+print(json.dumps({'total': total, 'imports': imports}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report the import time of the WSGI app per module and fail when startup takes longer than the budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float, default=settings.STARTUP_BUDGET_SECONDS,
+                            help='maximum startup time in seconds')
+        parser.add_argument('--top', type=int, default=15, help='number of modules to report')
+
+    def handle(self, *args, **options):
+        output = subprocess.check_output([sys.executable, '-c', MEASURE_STARTUP], cwd=settings.BASE_DIR)
+        startup = json.loads(output.decode().splitlines()[-1])
+
+        imports = sorted(startup['imports'].items(), key=lambda item: item[1], reverse=True)
+        for module, seconds in imports[:options['top']]:
+            self.stdout.write('%8.1f ms  %s' % (seconds * 1000, module))
+        self.stdout.write('Startup took %.1f ms, budget %.1f ms' % (startup['total'] * 1000,
+                                                                    options['budget'] * 1000))
+
+        if startup['total'] > options['budget']:
+            raise CommandError('Startup is over budget')
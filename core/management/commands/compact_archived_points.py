@@ -0,0 +1,94 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from core.models import GivenPointArchived, GivenPointArchivedSummary, TenantShard
+from core.utils import bump_tenant_data_version
+
+# Below the parameters SQLite takes in a query
+DELETE_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Replace the archived points older than ARCHIVE_RETENTION_WEEKS with the weekly totals of every member, ' \
+           'on every shard. Each batch of teams of a week is compacted in its own short transaction, the teams ' \
+           'being moved to another shard are left for the next run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retain-weeks', type=int, default=None,
+                            help='weeks of archived points kept in full, ARCHIVE_RETENTION_WEEKS by default')
+        parser.add_argument('--batch-size', type=int, default=100, help='teams compacted per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='seconds to wait between two transactions')
+
+    def handle(self, *args, **options):
+        retain_weeks = options['retain_weeks']
+        if retain_weeks is None:
+            retain_weeks = settings.ARCHIVE_RETENTION_WEEKS
+        today = datetime.date.today()
+        horizon = today - datetime.timedelta(days=today.weekday(), weeks=retain_weeks)
+        batch_size = options['batch_size']
+        locked = set(TenantShard.objects.using('default').filter(is_locked=True).values_list('instance_id', flat=True))
+
+        for database in settings.TENANT_SHARDS:
+            archived = GivenPointArchived.objects.using(database).filter(week__lt=horizon).order_by()
+            compacted = 0
+            for week in list(archived.values_list('week', flat=True).distinct()):
+                instance_ids = sorted(set(archived.filter(week=week).values_list('instance_id', flat=True)
+                                          .distinct()) - locked)
+                for offset in range(0, len(instance_ids), batch_size):
+                    compacted += self.compact(database, week, instance_ids[offset:offset + batch_size])
+                    time.sleep(options['pause'])
+            self.stdout.write('Compacted %s archived points older than %s on %s' % (compacted, horizon, database))
+
+    @staticmethod
+    def compact(database, week, instance_ids):
+        """
+        Add what every member of the teams received in the week to the summaries and delete the archived points,
+        returns the number of archived points deleted. Only the rows read are summed and deleted, the points archived
+        meanwhile, e.g. by a validation, are left for the next run.
+        """
+        archived = GivenPointArchived.objects.using(database).filter(week=week, instance_id__in=instance_ids)
+        summaries = GivenPointArchivedSummary.objects.using(database).filter(week=week, instance_id__in=instance_ids)
+        with transaction.atomic(using=database):
+            ids = []
+            totals = {}
+            for pk, to_member, instance_id, points in archived.order_by()\
+                    .values_list('id', 'to_member', 'instance_id', 'points').iterator():
+                ids.append(pk)
+                total = totals.setdefault((to_member, instance_id), [0, 0])
+                total[0] += points
+                total[1] += 1
+
+            # Points archived for a week compacted before, e.g. validated late, are added to its summaries
+            existing = dict(((summary.to_member_id, summary.instance_id), summary) for summary in summaries)
+            created = []
+            for (to_member, instance_id), (points, givers) in sorted(totals.items()):
+                summary = existing.get((to_member, instance_id))
+                if summary is None:
+                    created.append(GivenPointArchivedSummary(to_member_id=to_member, points=points, givers=givers,
+                                                             week=week, instance_id=instance_id))
+                else:
+                    summary.points += points
+                    summary.givers += givers
+                    summary.save(using=database)
+            GivenPointArchivedSummary.objects.using(database).bulk_create(created)
+
+            # By primary key, the week keeps PostgreSQL to a single partition. QuerySet.delete() would load every row.
+            connection = connections[database]
+            quote = connection.ops.quote_name
+            deleted = 0
+            with connection.cursor() as cursor:
+                for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+                    batch = ids[offset:offset + DELETE_BATCH_SIZE]
+                    cursor.execute('DELETE FROM %s WHERE %s = %%s AND %s IN (%s)' % (
+                        quote(GivenPointArchived._meta.db_table), quote('week'), quote('id'),
+                        ', '.join(['%s'] * len(batch))), [week] + batch)
+                    deleted += cursor.rowcount
+
+            # The history of the teams reads differently
+            for instance_id in instance_ids:
+                bump_tenant_data_version(instance_id, database)
+        return deleted
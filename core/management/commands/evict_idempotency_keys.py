@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.idempotency import get_expiry_horizon
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete the idempotency keys older than IDEMPOTENCY_KEY_TTL_SECONDS on every shard'
+
+    def handle(self, *args, **options):
+        horizon = get_expiry_horizon()
+        for database in settings.TENANT_SHARDS:
+            deleted, _ = IdempotencyKey.objects.using(database).filter(created__lt=horizon).delete()
+            self.stdout.write('Deleted %s idempotency keys from %s' % (deleted, database))
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from core.models import Team, Member, PointDistribution, GivenPoint, GivenPointArchived
+from core.points_operation import get_valid_point_values
+from core.utils import concatenate_and_hash, get_tenant_shard
+
+import random
+import time
+
+GIVEN_POINT_FIELDS = ('from_member', 'to_member', 'points', 'point_distribution', 'week', 'instance_id')
+ARCHIVED_FIELDS = ('from_member', 'to_member', 'points', 'week', 'instance_id')
+
+
+def parse_team_sizes(value):
+    """
+    Team sizes to pick from, e.g. '3-6,8,8,12': the 8 members teams are then twice as likely as the others
+    """
+    sizes = []
+    for part in value.split(','):
+        low, _, high = part.partition('-')
+        try:
+            sizes.extend(range(int(low), int(high or low) + 1))
+        except ValueError:
+            raise CommandError('Invalid team size %s' % part)
+    for size in set(sizes):
+        try:
+            get_valid_point_values(size)
+        except ValueError as e:
+            raise CommandError(e)
+    return sizes
+
+
+class Command(BaseCommand):
+    help = 'Generate tenants with members and weeks of validated point distributions, plus the provisional ' \
+           'distribution of the current week. The rows are written with bulk inserts, a transaction per chunk of ' \
+           'tenants.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=100)
+        parser.add_argument('--team-sizes', default='3-14', help='sizes to pick from, e.g. 3-6,8,8,12')
+        parser.add_argument('--weeks', type=int, default=52, help='validated weeks of history per tenant')
+        parser.add_argument('--prefix', default='synthetic', help='the instance_ids are <prefix>-<n>')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--chunk', type=int, default=50, help='tenants written per transaction')
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows per insert')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.sizes = parse_team_sizes(options['team_sizes'])
+        self.batch_size = options['batch_size']
+        self.counts = OrderedDict.fromkeys((Team, Member, PointDistribution, GivenPoint, GivenPointArchived), 0)
+
+        # Tenants are grouped by the shard they are placed on
+        databases = {}
+        for i in range(options['tenants']):
+            instance_id = '{}-{}'.format(options['prefix'], i)
+            shard = get_tenant_shard(instance_id, create=True)
+            database = shard.database if shard is not None else DEFAULT_DB_ALIAS
+            databases.setdefault(database, []).append(instance_id)
+
+        start = time.perf_counter()
+        for database, instance_ids in sorted(databases.items()):
+            for offset in range(0, len(instance_ids), options['chunk']):
+                with transaction.atomic(using=database):
+                    self.create_tenants(instance_ids[offset:offset + options['chunk']], options['weeks'], database)
+        elapsed = time.perf_counter() - start
+
+        rows = sum(self.counts.values())
+        for model, count in self.counts.items():
+            self.stdout.write('%-20s %10s rows' % (model.__name__, count))
+        self.stdout.write('Wrote %s rows in %.1fs (%.0f rows/s)' % (rows, elapsed, rows / elapsed if elapsed else 0))
+
+    def bulk_create(self, model, objs, database):
+        model.objects.using(database).bulk_create(objs)
+        self.counts[model] += len(objs)
+
+    def insert_rows(self, model, fields, rows, database):
+        """
+        Multi-row INSERTs of plain tuples, building and compiling a model instance per row costs more than the
+        insert itself
+        """
+        connection = connections[database]
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+        # SQLite caps the number of parameters of a query
+        batch_size = min(self.batch_size, connection.ops.bulk_batch_size(fields, rows))
+        with connection.cursor() as cursor:
+            for offset in range(0, len(rows), batch_size):
+                batch = rows[offset:offset + batch_size]
+                cursor.execute('INSERT INTO %s (%s) VALUES %s' % (quote(model._meta.db_table), columns,
+                                                                  ', '.join([placeholders] * len(batch))),
+                               [value for row in batch for value in row])
+        self.counts[model] += len(rows)
+
+    def create_tenants(self, instance_ids, weeks, database):
+        this_monday = date.today() - timedelta(days=date.today().weekday())
+        mondays = [this_monday - timedelta(weeks=i) for i in range(weeks, 0, -1)]
+        # Drawn and written in the order of the instance_ids, the same seed gives the same data
+        teams = OrderedDict((instance_id, self.random.choice(self.sizes)) for instance_id in instance_ids)
+
+        self.bulk_create(Team, [Team(instance_id=instance_id, instance_name=instance_id) for instance_id in teams],
+                         database)
+        self.bulk_create(Member, [
+            Member(email=email, name='Member {}'.format(i), instance_id=instance_id,
+                   identifier=concatenate_and_hash(email, instance_id))
+            for instance_id, size in teams.items()
+            for i, email in enumerate('member{}@{}.com'.format(i, instance_id) for i in range(size))
+        ], database)
+        self.bulk_create(PointDistribution, [
+            PointDistribution(identifier=concatenate_and_hash(monday, instance_id), week=monday, date=monday,
+                              is_final=monday != this_monday, instance_id=instance_id)
+            for instance_id in teams for monday in mondays + [this_monday]
+        ], database)
+
+        # bulk_create only sets the primary keys on PostgreSQL
+        members = {}
+        for instance_id, member_id in Member.objects.using(database).filter(instance_id__in=instance_ids)\
+                .order_by('id').values_list('instance_id', 'id'):
+            members.setdefault(instance_id, []).append(member_id)
+        distributions = dict(PointDistribution.objects.using(database).filter(instance_id__in=instance_ids)
+                             .values_list('identifier', 'id'))
+
+        for instance_id in instance_ids:
+            member_ids = members[instance_id]
+            # Written per tenant, a year of a large team is already thousands of rows
+            given_points = []
+            archived = []
+            values = get_valid_point_values(len(member_ids))
+            for monday in mondays:
+                self.random.shuffle(values)
+                distribution_id = distributions[concatenate_and_hash(monday, instance_id)]
+                # A validated week keeps the total of every member, what each member gave is archived
+                given_points.extend((None, to_member, points, distribution_id, monday, instance_id)
+                                    for to_member, points in zip(member_ids, values))
+                archived.extend((from_member, to_member, points, monday, instance_id)
+                                for from_member in member_ids for to_member, points in zip(member_ids, values))
+
+            # Part of the team already sent its points this week
+            self.random.shuffle(values)
+            distribution_id = distributions[concatenate_and_hash(this_monday, instance_id)]
+            senders = self.random.sample(member_ids, self.random.randint(0, len(member_ids)))
+            given_points.extend((from_member, to_member, points, distribution_id, this_monday, instance_id)
+                                for from_member in senders for to_member, points in zip(member_ids, values))
+
+            self.insert_rows(GivenPoint, GIVEN_POINT_FIELDS, given_points, database)
+            self.insert_rows(GivenPointArchived, ARCHIVED_FIELDS, archived, database)
@@ -0,0 +1,103 @@
+import itertools
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from core.models import TenantShard, Team, Member, PointDistribution, GivenPoint, GivenPointArchived, \
+    GivenPointArchivedSummary, TenantDataVersion, IdempotencyKey, TENANT_MODELS
+from core.purge import delete_rows
+from core.utils import get_tenant_shard
+
+
+class Command(BaseCommand):
+    help = 'Move the data of a tenant to another shard. Reads keep being served from the old shard during the copy, ' \
+           'writes are refused until the shard map points to the new one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('instance_id')
+        parser.add_argument('database', help='Alias of the target shard')
+        parser.add_argument('--grace', type=float, default=2.0,
+                            help='Seconds to wait for in-flight writes after locking the tenant')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows read and inserted at a time')
+
+    def handle(self, *args, **options):
+        instance_id = options['instance_id']
+        target = options['database']
+        if target not in settings.TENANT_SHARDS:
+            raise CommandError('Unknown shard %s, configured shards are %s' % (
+                target, ', '.join(settings.TENANT_SHARDS)))
+        shard = get_tenant_shard(instance_id, create=True)
+        if shard is None:
+            raise CommandError('No shards are configured')
+        source = shard.database
+        if source == target:
+            raise CommandError('Tenant %s is already on %s' % (instance_id, target))
+
+        shard.is_locked = True
+        shard.save(using='default')
+        try:
+            time.sleep(options['grace'])
+            # Rows left on the target by a failed move are deleted first, the copy then commits chunk by chunk
+            self.delete_tenant(instance_id, target)
+            self.copy_tenant(instance_id, source, target, options['batch_size'])
+            shard.database = target
+        finally:
+            shard.is_locked = False
+            shard.save(using='default')
+
+        # The old copy is only deleted once the saved shard map is known to serve the tenant from the target
+        saved = TenantShard.objects.using('default').filter(instance_id=instance_id)\
+            .values_list('database', 'is_locked').first()
+        if saved != (target, False):
+            raise CommandError('The shard map of %s does not point to %s, its data is kept on %s' % (
+                instance_id, target, source))
+        self.delete_tenant(instance_id, source)
+        self.stdout.write('Moved tenant %s from %s to %s' % (instance_id, source, target))
+
+    @staticmethod
+    def delete_tenant(instance_id, database):
+        with transaction.atomic(using=database):
+            # The data version moves along, the ETags handed out before the move stay valid
+            for model in TENANT_MODELS + (TenantDataVersion,):
+                delete_rows(model, database, instance_id)
+
+    @staticmethod
+    def copy_tenant(instance_id, source, target, batch_size):
+        """
+        Copy the rows of the tenant, streamed from the source and inserted batch_size rows at a time. The target gives
+        new surrogate keys, so the foreign keys are mapped through the member and distribution hashes.
+        """
+        def copy(model, remap=lambda values: values):
+            fields = [field.attname for field in model._meta.fields if not isinstance(field, models.AutoField)]
+            rows = model.objects.using(source).filter(instance_id=instance_id).values(*fields).iterator()
+            while True:
+                batch = [model(**remap(values)) for values in itertools.islice(rows, batch_size)]
+                if not batch:
+                    break
+                model.objects.using(target).bulk_create(batch, batch_size=batch_size)
+
+        def id_map(model):
+            source_ids = model.objects.using(source).filter(instance_id=instance_id).values_list('identifier', 'id')
+            target_ids = dict(model.objects.using(target).filter(instance_id=instance_id)
+                              .values_list('identifier', 'id'))
+            return {source_id: target_ids[identifier] for identifier, source_id in source_ids}
+
+        # The stored responses move along so that retries are still replayed
+        for model in (Team, TenantDataVersion, IdempotencyKey, Member, PointDistribution):
+            copy(model)
+        member_ids = id_map(Member)
+        distribution_ids = id_map(PointDistribution)
+
+        def remap(values):
+            values['to_member_id'] = member_ids[values['to_member_id']]
+            if values.get('from_member_id') is not None:
+                values['from_member_id'] = member_ids[values['from_member_id']]
+            if 'point_distribution_id' in values:
+                values['point_distribution_id'] = distribution_ids[values['point_distribution_id']]
+            return values
+
+        copy(GivenPoint, remap)
+        copy(GivenPointArchived, remap)
+        copy(GivenPointArchivedSummary, remap)
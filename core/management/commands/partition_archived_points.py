@@ -0,0 +1,111 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core.models import GivenPointArchived
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = 'Create the upcoming monthly partitions of the archived points and detach the old ones, on every shard ' \
+           '(PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help='Number of months to create ahead of the current one')
+        parser.add_argument('--retain-months', type=int, default=None,
+                            help='Detach the partitions that end more than this many months ago')
+        parser.add_argument('--drop', action='store_true', help='Drop the detached partitions')
+
+    def handle(self, *args, **options):
+        self.table = GivenPointArchived._meta.db_table
+        for database in settings.TENANT_SHARDS:
+            self.database = database
+            self.connection = connections[database]
+            if self.connection.vendor != 'postgresql':
+                self.stdout.write('Archived points are a single table on %s (%s), nothing to do' % (
+                    database, self.connection.vendor))
+                continue
+            if not self.is_partitioned():
+                raise CommandError('%s is not a partitioned table on %s, run the migrations first' % (
+                    self.table, database))
+            self.partition(options)
+
+    def partition(self, options):
+        current_month = datetime.date.today().replace(day=1)
+        first_month = self.get_oldest_default_month() or current_month
+        month = min(first_month, current_month)
+        existing = set(self.get_partitions())
+        while month <= add_months(current_month, options['ahead']):
+            if self.partition_name(month) not in existing:
+                self.create_partition(month)
+            month = add_months(month, 1)
+
+        if options['retain_months'] is not None:
+            horizon = add_months(current_month, -options['retain_months'])
+            for month in sorted(self.get_partitions().values()):
+                if add_months(month, 1) <= horizon:
+                    self.detach_partition(month, options['drop'])
+
+    def partition_name(self, month):
+        return '%s_y%04dm%02d' % (self.table, month.year, month.month)
+
+    def is_partitioned(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+                           'WHERE c.relname = %s', [self.table])
+            return cursor.fetchone() is not None
+
+    def get_partitions(self):
+        """
+        Monthly partitions as a name to first day of the month dictionary, the default partition is left out
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                           'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s', [self.table])
+            names = [row[0] for row in cursor.fetchall()]
+        partitions = {}
+        for name in names:
+            try:
+                partitions[name] = datetime.datetime.strptime(name[len(self.table):], '_y%Ym%m').date()
+            except ValueError:
+                continue
+        return partitions
+
+    def get_oldest_default_month(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT MIN(week) FROM %s' % self.connection.ops.quote_name(self.table + '_default'))
+            oldest = cursor.fetchone()[0]
+        return oldest.replace(day=1) if oldest is not None else None
+
+    def create_partition(self, month):
+        """
+        Rows of the month already in the default partition are moved to the new one before it is attached
+        """
+        quote = self.connection.ops.quote_name
+        names = {'table': quote(self.table), 'default': quote(self.table + '_default'),
+                 'partition': quote(self.partition_name(month))}
+        bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+        with transaction.atomic(using=self.database), self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                           .format(**names))
+            cursor.execute('INSERT INTO {partition} SELECT * FROM {default} WHERE week >= %s AND week < %s'
+                           .format(**names), bounds)
+            cursor.execute('DELETE FROM {default} WHERE week >= %s AND week < %s'.format(**names), bounds)
+            cursor.execute('ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)'
+                           .format(**names), bounds)
+        self.stdout.write('Created partition %s on %s' % (self.partition_name(month), self.database))
+
+    def detach_partition(self, month, drop):
+        quote = self.connection.ops.quote_name
+        name = self.partition_name(month)
+        with self.connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (quote(self.table), quote(name)))
+            if drop:
+                cursor.execute('DROP TABLE %s' % quote(name))
+        self.stdout.write('%s partition %s on %s' % ('Dropped' if drop else 'Detached', name, self.database))
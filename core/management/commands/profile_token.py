@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print an X-Profile-Token header value, the requests sending it are profiled when PROFILING_ENABLED is set'
+
+    def handle(self, *args, **options):
+        self.stdout.write('X-Profile-Token: %s' % make_token())
+        self.stdout.write('Valid for %s seconds' % settings.PROFILING_TOKEN_MAX_AGE)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.purge import purge_tenant, truncate_all
+from core.utils import get_tenant_shard
+
+
+class Command(BaseCommand):
+    help = 'Delete all the data of the given tenants from their shard, with one DELETE per table. --all empties the ' \
+           'tables of every tenant on every shard, for test environments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('instance_ids', nargs='*')
+        parser.add_argument('--all', action='store_true', help='delete the data of every tenant')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            if options['instance_ids']:
+                raise CommandError('Give either instance_ids or --all')
+            truncate_all()
+            self.stdout.write('Deleted the data of every tenant')
+            return
+        if not options['instance_ids']:
+            raise CommandError('Give the instance_ids to purge, or --all')
+
+        for instance_id in options['instance_ids']:
+            shard = get_tenant_shard(instance_id)
+            if shard is not None and shard.is_locked:
+                raise CommandError('Tenant %s is being moved, try again once the move is done' % instance_id)
+            database = shard.database if shard is not None else DEFAULT_DB_ALIAS
+            deleted = purge_tenant(instance_id, database)
+            self.stdout.write('Purged %s from %s: %s' % (
+                instance_id, database, ', '.join('%s %s' % (count, model) for model, count in deleted.items())))
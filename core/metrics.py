@@ -0,0 +1,173 @@
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+import os
+import threading
+import time
+
+# prometheus_client is imported when the first metric is recorded, the workers start without it
+
+# Labels are limited to the view class, the method and the status so their number stays bounded, tenants are never
+# labels
+LABELS = ('view', 'method', 'status')
+
+_local = threading.local()
+_collectors = None
+_lock = threading.Lock()
+
+
+class Collectors(object):
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+        self.request_duration = Histogram('pointdistribution_request_duration_seconds',
+                                          'Time spent serving requests', LABELS)
+        self.request_queries = Histogram('pointdistribution_request_db_queries', 'Database queries per request',
+                                         LABELS, buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, float('inf')))
+        self.request_query_seconds = Counter('pointdistribution_request_db_seconds',
+                                             'Time spent in database queries', LABELS)
+        self.request_outbound = Histogram('pointdistribution_request_outbound_calls',
+                                          'Outbound HTTP calls per request', LABELS,
+                                          buckets=(0, 1, 2, 5, 10, 20, 50, float('inf')))
+        self.request_outbound_seconds = Counter('pointdistribution_request_outbound_seconds',
+                                                'Time spent waiting on outbound HTTP calls', LABELS)
+        self.outbound_duration = Histogram('pointdistribution_outbound_duration_seconds',
+                                           'Latency of the outbound HTTP calls', ('dependency',))
+        self.outbound_errors = Counter('pointdistribution_outbound_errors', 'Failed outbound HTTP calls by reason',
+                                       ('dependency', 'reason'))
+
+
+def get_collectors():
+    global _collectors
+    if _collectors is None:
+        with _lock:
+            if _collectors is None:
+                _collectors = Collectors()
+    return _collectors
+
+
+class RequestStats(object):
+    __slots__ = ('queries', 'query_seconds', 'outbound', 'outbound_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.outbound = 0
+        self.outbound_seconds = 0.0
+
+
+class TimedCursorWrapper(CursorWrapper):
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, param_list)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+def instrument_connections():
+    """
+    Time the cursors of the connections of this thread, done before the first query so none is missed
+    """
+    for connection in connections.all():
+        if getattr(connection, 'metrics_instrumented', False):
+            continue
+        connection.make_cursor = wrap_cursors(connection, connection.make_cursor)
+        connection.make_debug_cursor = wrap_cursors(connection, connection.make_debug_cursor)
+        connection.metrics_instrumented = True
+
+
+def wrap_cursors(connection, make_cursor):
+    return lambda cursor: TimedCursorWrapper(make_cursor(cursor), connection)
+
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def finish_request(view, method, status, duration):
+    stats = _local.stats
+    _local.stats = None
+    labels = (view, method, status)
+    collectors = get_collectors()
+    collectors.request_duration.labels(*labels).observe(duration)
+    collectors.request_queries.labels(*labels).observe(stats.queries)
+    collectors.request_query_seconds.labels(*labels).inc(stats.query_seconds)
+    collectors.request_outbound.labels(*labels).observe(stats.outbound)
+    collectors.request_outbound_seconds.labels(*labels).inc(stats.outbound_seconds)
+
+
+def get_request_stats():
+    """
+    Counters of the request being served by this thread, None outside of a request
+    """
+    return getattr(_local, 'stats', None)
+
+
+def record_query(seconds):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+
+
+def observe_outbound(dependency, seconds):
+    get_collectors().outbound_duration.labels(dependency).observe(seconds)
+
+
+def count_outbound_error(dependency, reason):
+    get_collectors().outbound_errors.labels(dependency, reason).inc()
+
+
+def record_outbound(seconds, calls=1):
+    """
+    Only calls made while serving a request of this thread are counted
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.outbound += calls
+        stats.outbound_seconds += seconds
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return getattr(match.func, 'view_class', match.func).__name__
+
+
+def get_query_budget(request):
+    """
+    Most queries the view of the request declares it runs for the method, None when it declares none. Views serving
+    several teams at once also declare a tenant_query_budget, added for every team of the request.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view_class = getattr(match.func, 'view_class', None)
+    method = request.method.lower()
+    budget = getattr(view_class, 'query_budget', {}).get(method)
+    tenant_budget = getattr(view_class, 'tenant_query_budget', {}).get(method)
+    if budget is not None and tenant_budget is not None:
+        budget += tenant_budget * getattr(request, 'tenants_count', 0)
+    return budget
+
+
+def render():
+    """
+    Metrics in the Prometheus text format, aggregated over the gunicorn workers when prometheus_multiproc_dir is set
+    """
+    from prometheus_client import CollectorRegistry, REGISTRY, generate_latest, multiprocess
+    get_collectors()
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from . import metrics, profiling
+
+import logging
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts both with the same quality
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def parse_accept_encoding(header):
+    """
+    Quality of every coding in an Accept-Encoding header
+    """
+    qualities = {}
+    for coding in header.split(','):
+        coding, _, params = coding.strip().partition(';')
+        if coding == '':
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities
+
+
+def choose_encoding(header):
+    qualities = parse_accept_encoding(header)
+    default = qualities.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def get_compressor(encoding):
+    """
+    Object compressing whole responses with compress() or streams with process() and finish()
+    """
+    if encoding == 'br':
+        return BrotliCompressor()
+    return GzipCompressor()
+
+
+class GzipCompressor(object):
+    def __init__(self):
+        # 16 + MAX_WBITS writes the gzip header and trailer
+        self.compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush()
+
+    def process(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor(object):
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.finish()
+
+    def process(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def compress_sequence(sequence, compressor):
+    for data in sequence:
+        chunk = compressor.process(data)
+        if chunk:
+            yield chunk
+    yield compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """
+    Compress the responses with brotli (when installed) or gzip, whichever the client prefers in Accept-Encoding.
+    Streamed responses are compressed chunk by chunk, responses shorter than COMPRESSION_MIN_SIZE are sent as they
+    are.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressor = get_compressor(encoding)
+        if response.streaming:
+            # The compressed size is not known until the end of the stream
+            response.streaming_content = compress_sequence(response.streaming_content, compressor)
+            del response['Content-Length']
+        else:
+            content = compressor.compress(response.content)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # A weak ETag still matches the unquoted tenant_etag in the condition() of the views, so compressed
+        # responses keep getting 304s
+        etag = response.get('ETag', '')
+        if etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Record the latency, the database queries and the outbound calls of every request per view, method and status.
+    While debugging the requests running more queries than the query_budget of their view are logged.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.instrument_connections()
+        # Kept on the request for the callers of the test client, e.g. manage.py benchmark_lifecycle
+        request.metrics = metrics.start_request()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        view = metrics.get_view_name(request)
+        metrics.finish_request(view, request.method, str(response.status_code), time.perf_counter() - start)
+        if settings.DEBUG:
+            budget = metrics.get_query_budget(request)
+            if budget is not None and request.metrics.queries > budget:
+                logging.warning("%s %s ran %s queries, its budget is %s", view, request.method,
+                                request.metrics.queries, budget)
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile the requests carrying a valid X-Profile-Token header and PROFILING_SAMPLE_RATE of the others when
+    PROFILING_ENABLED is set. The profiles are stored with the view, the tenant and the number of queries of the
+    request.
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.should_profile(request):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        profiler = profiling.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - start
+
+        stats = metrics.get_request_stats()
+        profiling.save(profiler, {
+            'time': time.time(),
+            'view': metrics.get_view_name(request),
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'tenant': profiling.get_tenant(),
+            'queries': stats.queries if stats is not None else None,
+            'duration': duration,
+        })
+        return response
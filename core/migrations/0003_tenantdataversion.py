@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 06:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_team'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantDataVersion',
+            fields=[
+                ('instance_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 07:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_tenantdataversion'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='givenpoint',
+            index_together=set([('instance_id', 'week', 'from_member')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='givenpointarchived',
+            index_together=set([('instance_id', 'to_member', 'week')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='member',
+            index_together=set([('instance_id', 'email')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='pointdistribution',
+            index_together=set([('instance_id', 'is_final', 'week')]),
+        ),
+    ]
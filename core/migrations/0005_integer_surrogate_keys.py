@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_to_surrogate_keys(apps, schema_editor):
+    """
+    Copy every row into the new tables, rewriting the hash foreign keys into the new integer keys with set based
+    INSERT ... SELECT statements so that no row is loaded into Python
+    """
+    statements = [
+        'INSERT INTO {NewMember} (identifier, name, email, instance_id) '
+        'SELECT identifier, name, email, instance_id FROM {Member} ORDER BY instance_id, email',
+        'INSERT INTO {NewPointDistribution} (identifier, week, date, is_final, instance_id) '
+        'SELECT identifier, week, date, is_final, instance_id FROM {PointDistribution} ORDER BY instance_id, week',
+        'INSERT INTO {NewGivenPoint} (id, from_member_id, to_member_id, points, point_distribution_id, week, '
+        'instance_id) '
+        'SELECT gp.id, fm.id, tm.id, gp.points, pd.id, gp.week, gp.instance_id FROM {GivenPoint} gp '
+        'LEFT OUTER JOIN {NewMember} fm ON fm.identifier = gp.from_member_id '
+        'INNER JOIN {NewMember} tm ON tm.identifier = gp.to_member_id '
+        'INNER JOIN {NewPointDistribution} pd ON pd.identifier = gp.point_distribution_id',
+        'INSERT INTO {NewGivenPointArchived} (id, from_member_id, to_member_id, points, week, instance_id) '
+        'SELECT gp.id, fm.id, tm.id, gp.points, gp.week, gp.instance_id FROM {GivenPointArchived} gp '
+        'LEFT OUTER JOIN {NewMember} fm ON fm.identifier = gp.from_member_id '
+        'INNER JOIN {NewMember} tm ON tm.identifier = gp.to_member_id',
+    ]
+    copy_rows(apps, schema_editor, statements, ('NewGivenPoint', 'NewGivenPointArchived'))
+
+
+def copy_to_hash_keys(apps, schema_editor):
+    """
+    Copy every row back into the tables keyed by the hashes, the integer foreign keys are rewritten into the member and
+    distribution hashes
+    """
+    statements = [
+        'INSERT INTO {Member} (identifier, name, email, instance_id) '
+        'SELECT identifier, name, email, instance_id FROM {NewMember}',
+        'INSERT INTO {PointDistribution} (identifier, week, date, is_final, instance_id) '
+        'SELECT identifier, week, date, is_final, instance_id FROM {NewPointDistribution}',
+        'INSERT INTO {GivenPoint} (id, from_member_id, to_member_id, points, point_distribution_id, week, instance_id) '
+        'SELECT gp.id, fm.identifier, tm.identifier, gp.points, pd.identifier, gp.week, gp.instance_id '
+        'FROM {NewGivenPoint} gp '
+        'LEFT OUTER JOIN {NewMember} fm ON fm.id = gp.from_member_id '
+        'INNER JOIN {NewMember} tm ON tm.id = gp.to_member_id '
+        'INNER JOIN {NewPointDistribution} pd ON pd.id = gp.point_distribution_id',
+        'INSERT INTO {GivenPointArchived} (id, from_member_id, to_member_id, points, week, instance_id) '
+        'SELECT gp.id, fm.identifier, tm.identifier, gp.points, gp.week, gp.instance_id '
+        'FROM {NewGivenPointArchived} gp '
+        'LEFT OUTER JOIN {NewMember} fm ON fm.id = gp.from_member_id '
+        'INNER JOIN {NewMember} tm ON tm.id = gp.to_member_id',
+    ]
+    copy_rows(apps, schema_editor, statements, ('GivenPoint', 'GivenPointArchived'))
+
+
+def copy_rows(apps, schema_editor, statements, copied_ids):
+    tables = dict((name, apps.get_model('core', name)._meta.db_table) for name in
+                  ('Member', 'PointDistribution', 'GivenPoint', 'GivenPointArchived',
+                   'NewMember', 'NewPointDistribution', 'NewGivenPoint', 'NewGivenPointArchived'))
+    for statement in statements:
+        schema_editor.execute(statement.format(**tables))
+    # Given point ids were copied over, move the sequences past them
+    models_with_ids = [apps.get_model('core', name) for name in copied_ids]
+    for statement in schema_editor.connection.ops.sequence_reset_sql(no_style(), models_with_ids):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_tenant_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(max_length=30)),
+                ('email', models.EmailField(max_length=30)),
+                ('instance_id', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NewPointDistribution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=255, unique=True)),
+                ('week', models.DateField()),
+                ('date', models.DateField()),
+                ('is_final', models.BooleanField()),
+                ('instance_id', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NewGivenPoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField()),
+                ('week', models.DateField()),
+                ('instance_id', models.CharField(max_length=255)),
+                ('from_member', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='core_newgivenpoint_fromMember', to='core.NewMember')),
+                ('to_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_newgivenpoint_toMember', to='core.NewMember')),
+                ('point_distribution', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='given_points', to='core.NewPointDistribution')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NewGivenPointArchived',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField()),
+                ('week', models.DateField()),
+                ('instance_id', models.CharField(max_length=255)),
+                ('from_member', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='core_newgivenpointarchived_fromMember', to='core.NewMember')),
+                ('to_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_newgivenpointarchived_toMember', to='core.NewMember')),
+            ],
+        ),
+        migrations.RunPython(copy_to_surrogate_keys, copy_to_hash_keys),
+        migrations.DeleteModel(
+            name='GivenPoint',
+        ),
+        migrations.DeleteModel(
+            name='GivenPointArchived',
+        ),
+        migrations.DeleteModel(
+            name='Member',
+        ),
+        migrations.DeleteModel(
+            name='PointDistribution',
+        ),
+        migrations.RenameModel(
+            old_name='NewMember',
+            new_name='Member',
+        ),
+        migrations.RenameModel(
+            old_name='NewPointDistribution',
+            new_name='PointDistribution',
+        ),
+        migrations.RenameModel(
+            old_name='NewGivenPoint',
+            new_name='GivenPoint',
+        ),
+        migrations.RenameModel(
+            old_name='NewGivenPointArchived',
+            new_name='GivenPointArchived',
+        ),
+        migrations.AlterField(
+            model_name='givenpoint',
+            name='from_member',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='core_givenpoint_fromMember', to='core.Member'),
+        ),
+        migrations.AlterField(
+            model_name='givenpoint',
+            name='to_member',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_givenpoint_toMember', to='core.Member'),
+        ),
+        migrations.AlterField(
+            model_name='givenpointarchived',
+            name='from_member',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='core_givenpointarchived_fromMember', to='core.Member'),
+        ),
+        migrations.AlterField(
+            model_name='givenpointarchived',
+            name='to_member',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_givenpointarchived_toMember', to='core.Member'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pointdistribution',
+            unique_together=set([('week', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='pointdistribution',
+            index_together=set([('instance_id', 'is_final', 'week')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='member',
+            unique_together=set([('email', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='member',
+            index_together=set([('instance_id', 'email')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='givenpointarchived',
+            unique_together=set([('to_member', 'week', 'from_member', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='givenpointarchived',
+            index_together=set([('instance_id', 'to_member', 'week')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='givenpoint',
+            unique_together=set([('to_member', 'week', 'from_member', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='givenpoint',
+            index_together=set([('instance_id', 'week', 'from_member')]),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def partition_archived_points(apps, schema_editor):
+    """
+    Turn the archive table into a table partitioned by week range. Rows land in the default partition and are split
+    into monthly partitions by the partition_archived_points command. Other databases keep a single table.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('core', 'GivenPointArchived')._meta.db_table
+    member_table = apps.get_model('core', 'Member')._meta.db_table
+    names = {'table': table, 'legacy': table + '_legacy', 'member': member_table}
+    statements = [
+        'ALTER TABLE {table} RENAME TO {legacy}',
+        'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (week)',
+        'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey_week PRIMARY KEY (id, week)',
+        'ALTER TABLE {table} ADD CONSTRAINT {table}_uniq_week '
+        'UNIQUE (to_member_id, week, from_member_id, instance_id)',
+        'ALTER TABLE {table} ADD CONSTRAINT {table}_from_member_fk FOREIGN KEY (from_member_id) '
+        'REFERENCES {member} (id) DEFERRABLE INITIALLY DEFERRED',
+        'ALTER TABLE {table} ADD CONSTRAINT {table}_to_member_fk FOREIGN KEY (to_member_id) '
+        'REFERENCES {member} (id) DEFERRABLE INITIALLY DEFERRED',
+        'CREATE INDEX {table}_from_member ON {table} (from_member_id)',
+        'CREATE INDEX {table}_instance_to_member_week ON {table} (instance_id, to_member_id, week)',
+        'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT',
+        'INSERT INTO {table} SELECT * FROM {legacy}',
+        'ALTER SEQUENCE {sequence} OWNED BY {table}.id',
+        'DROP TABLE {legacy}',
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        names['sequence'] = cursor.fetchone()[0]
+    for statement in statements:
+        schema_editor.execute(statement.format(**names))
+
+
+def unpartition_archived_points(apps, schema_editor):
+    """
+    Copy the partitions back into a single table, the detached partitions are left alone
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('core', 'GivenPointArchived')._meta.db_table
+    member_table = apps.get_model('core', 'Member')._meta.db_table
+    names = {'table': table, 'plain': table + '_plain', 'member': member_table}
+    statements = [
+        'CREATE TABLE {plain} (LIKE {table} INCLUDING DEFAULTS)',
+        'ALTER TABLE {plain} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)',
+        'ALTER TABLE {plain} ADD CONSTRAINT {table}_uniq UNIQUE (to_member_id, week, from_member_id, instance_id)',
+        'ALTER TABLE {plain} ADD CONSTRAINT {table}_from_member_fk FOREIGN KEY (from_member_id) '
+        'REFERENCES {member} (id) DEFERRABLE INITIALLY DEFERRED',
+        'ALTER TABLE {plain} ADD CONSTRAINT {table}_to_member_fk FOREIGN KEY (to_member_id) '
+        'REFERENCES {member} (id) DEFERRABLE INITIALLY DEFERRED',
+        'CREATE INDEX {table}_from_member_id ON {plain} (from_member_id)',
+        'CREATE INDEX {table}_instance_to_member ON {plain} (instance_id, to_member_id, week)',
+        'INSERT INTO {plain} SELECT * FROM {table}',
+        'ALTER SEQUENCE {sequence} OWNED BY {plain}.id',
+        'DROP TABLE {table}',
+        'ALTER TABLE {plain} RENAME TO {table}',
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        names['sequence'] = cursor.fetchone()[0]
+    for statement in statements:
+        schema_editor.execute(statement.format(**names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_integer_surrogate_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_archived_points, unpartition_archived_points),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 07:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_partition_givenpointarchived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantShard',
+            fields=[
+                ('instance_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('database', models.CharField(max_length=255)),
+                ('is_locked', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 07:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tenantshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenantdataversion',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 07:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_tenantdataversion_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('status_code', models.PositiveSmallIntegerField(null=True)),
+                ('body', models.TextField(blank=True)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together=set([('instance_id', 'key')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-19 07:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GivenPointArchivedSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField()),
+                ('givers', models.IntegerField()),
+                ('week', models.DateField()),
+                ('instance_id', models.CharField(max_length=255)),
+                ('to_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='core_givenpointarchivedsummary_toMember', to='core.Member')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='givenpointarchivedsummary',
+            unique_together=set([('to_member', 'week', 'instance_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='givenpointarchivedsummary',
+            index_together=set([('instance_id', 'to_member', 'week')]),
+        ),
+    ]
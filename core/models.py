@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Team(models.Model):
@@ -10,20 +11,21 @@ class Team(models.Model):
 
 
 class Member(models.Model):
-    identifier = models.CharField(primary_key=True, max_length=255)
+    identifier = models.CharField(max_length=255, unique=True)
     name = models.CharField(max_length=30)
     email = models.EmailField(max_length=30)
     instance_id = models.CharField(max_length=255)
 
     class Meta:
         unique_together = ('email', 'instance_id')
+        index_together = [('instance_id', 'email')]
 
     def __str__(self):
         return self.email.__str__() + "/%s" % (self.instance_id.__str__())
 
 
 class PointDistribution(models.Model):
-    identifier = models.CharField(primary_key=True, max_length=255)
+    identifier = models.CharField(max_length=255, unique=True)
     week = models.DateField()
     date = models.DateField()
     is_final = models.BooleanField()
@@ -31,6 +33,7 @@ class PointDistribution(models.Model):
 
     class Meta:
         unique_together = ('week', 'instance_id')
+        index_together = [('instance_id', 'is_final', 'week')]
 
     def __str__(self):
         return self.week.__str__() + ", " + ("final" if self.is_final else "provisional")
@@ -47,6 +50,7 @@ class GivenPoint(models.Model):
 
     class Meta:
         unique_together = ('to_member', 'week', 'from_member', 'instance_id')
+        index_together = [('instance_id', 'week', 'from_member')]
 
     def __str__(self):
         return self.week.__str__() + ", from " + self.from_member.__str__() + " to " + self.to_member.__str__()
@@ -62,3 +66,63 @@ class GivenPointArchived(models.Model):
 
     class Meta:
         unique_together = ('to_member', 'week', 'from_member', 'instance_id')
+        index_together = [('instance_id', 'to_member', 'week')]
+
+
+class GivenPointArchivedSummary(models.Model):
+    """
+    What a member received in a week from all the givers, the archived points older than ARCHIVE_RETENTION_WEEKS are
+    compacted into it by manage.py compact_archived_points
+    """
+    to_member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="%(app_label)s_%(class)s_toMember")
+    points = models.IntegerField()
+    givers = models.IntegerField()
+    week = models.DateField()
+    instance_id = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('to_member', 'week', 'instance_id')
+        index_together = [('instance_id', 'to_member', 'week')]
+
+    def __str__(self):
+        return self.week.__str__() + ", " + self.points.__str__() + " points to " + self.to_member.__str__()
+
+
+class TenantDataVersion(models.Model):
+    instance_id = models.CharField(max_length=255, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.instance_id.__str__() + " - v%s" % (self.version.__str__())
+
+
+class TenantShard(models.Model):
+    instance_id = models.CharField(max_length=255, primary_key=True)
+    database = models.CharField(max_length=255)
+    is_locked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.instance_id.__str__() + " - " + self.database.__str__()
+
+
+class IdempotencyKey(models.Model):
+    instance_id = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=32)
+    # No status code yet while the first request with the key is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    body = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ('instance_id', 'key')
+
+    def __str__(self):
+        return self.key.__str__() + "/%s" % (self.instance_id.__str__())
+
+
+# The models holding the data of a tenant, children first so that deleting in this order never removes a row still
+# referenced. TenantDataVersion is not one of them, its version must never start over (see core.purge).
+TENANT_MODELS = (GivenPoint, GivenPointArchived, GivenPointArchivedSummary, PointDistribution, Member, Team,
+                 IdempotencyKey)
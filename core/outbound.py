@@ -0,0 +1,190 @@
+from django.conf import settings
+
+from .exceptions import DependencyUnavailableException
+from . import metrics
+
+import logging
+import threading
+import time
+
+# requests and the thread pool are imported on the first outbound call, most workers start without needing them
+
+TOKENSTORAGE = 'tokenstorage'
+VSTS = 'vsts'
+SLACKBOT = 'slackbot'
+
+_sessions = {}
+_breakers = {}
+_executor = None
+_lock = threading.Lock()
+
+
+class CircuitBreaker(object):
+    """
+    Opens after OUTBOUND_BREAKER_FAILURES consecutive failures of a dependency, the calls then fail fast. After
+    OUTBOUND_BREAKER_RESET_SECONDS one trial call is let through, its outcome closes or opens the breaker again.
+    """
+    def __init__(self, dependency, failures, reset_seconds):
+        self.dependency = dependency
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info("Circuit breaker of %s closed", self.dependency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.trial = False
+            if self.opened_at is None and self.consecutive_failures >= self.failures:
+                logging.warning("Circuit breaker of %s opened after %s failures", self.dependency,
+                                self.consecutive_failures)
+                self.opened_at = time.monotonic()
+            elif self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+def get_session(dependency):
+    """
+    One pooled session per dependency so connections are kept alive between requests
+    """
+    session = _sessions.get(dependency)
+    if session is None:
+        with _lock:
+            session = _sessions.get(dependency)
+            if session is None:
+                import requests
+                session = requests.Session()
+                pool_size = settings.OUTBOUND_DEPENDENCIES[dependency]['pool_size']
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[dependency] = session
+    return session
+
+
+def get_breaker(dependency):
+    breaker = _breakers.get(dependency)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(dependency)
+            if breaker is None:
+                breaker = CircuitBreaker(dependency, settings.OUTBOUND_BREAKER_FAILURES,
+                                         settings.OUTBOUND_BREAKER_RESET_SECONDS)
+                _breakers[dependency] = breaker
+    return breaker
+
+
+def get_executor():
+    """
+    Created on first use so that every worker process gets its own threads
+    """
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _executor = ThreadPoolExecutor(max_workers=settings.OUTBOUND_MAX_WORKERS)
+    return _executor
+
+
+def drain():
+    """
+    Wait for the background calls of this process, run when a worker exits so that the notifications still queued
+    are sent. The next background call starts a new pool.
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def request(dependency, method, url, **kwargs):
+    """
+    Call a dependency with its connect and read timeouts. Connection errors, timeouts and an open circuit breaker
+    raise DependencyUnavailableException, 5xx responses are returned but count as failures of the dependency.
+    """
+    import requests
+    breaker = get_breaker(dependency)
+    if not breaker.allow():
+        metrics.count_outbound_error(dependency, 'circuit_open')
+        raise DependencyUnavailableException()
+
+    config = settings.OUTBOUND_DEPENDENCIES[dependency]
+    kwargs.setdefault('timeout', (config['connect_timeout'], config['read_timeout']))
+    start = time.perf_counter()
+    try:
+        response = get_session(dependency).request(method, url, **kwargs)
+    except requests.RequestException as e:
+        breaker.record_failure()
+        metrics.count_outbound_error(dependency, 'timeout' if isinstance(e, requests.Timeout) else 'error')
+        logging.warning("Call to %s failed: %s", dependency, e)
+        raise DependencyUnavailableException() from e
+    except Exception:
+        # Anything else, e.g. an invalid URL, still ends a trial call or the breaker would stay half open
+        breaker.record_failure()
+        metrics.count_outbound_error(dependency, 'error')
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe_outbound(dependency, elapsed)
+        metrics.record_outbound(elapsed)
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+        metrics.count_outbound_error(dependency, 'status')
+    else:
+        breaker.record_success()
+    return response
+
+
+def gather(calls):
+    """
+    Run (dependency, method, url, kwargs) calls concurrently, responses are returned in the same order
+    """
+    start = time.perf_counter()
+    futures = [get_executor().submit(request, dependency, method, url, **kwargs)
+               for dependency, method, url, kwargs in calls]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        # The calls run on the pool, the request waited for all of them
+        metrics.record_outbound(time.perf_counter() - start, len(calls))
+
+
+def send_in_background(dependency, method, url, callback=None, **kwargs):
+    """
+    Fire and forget a call, the callback receives the response once it completes
+    """
+    future = get_executor().submit(request, dependency, method, url, **kwargs)
+    future.add_done_callback(lambda done: _complete(dependency, done, callback))
+    return future
+
+
+def _complete(dependency, future, callback):
+    try:
+        response = future.result()
+    except DependencyUnavailableException:
+        logging.warning("Background call to %s was not sent", dependency)
+        return
+    if callback is not None:
+        callback(response)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.utils import six
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import FastJSONRenderer, MessagePackRenderer, orjson
+
+import msgpack
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parses with orjson when it is installed
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return orjson.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % six.text_type(exc))
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses Content-Type: application/msgpack bodies
+    """
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.exceptions.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % six.text_type(exc))
@@ -1,17 +1,20 @@
 from .exceptions import RepeatedPointValueException, MembersMissingException, InvalidSumPointsException, \
     ConflictInPointsToMemberException, InvalidOrRepeatedMemberException, PointValueNotValidException, \
     NotAllMembersGavePointsException
-from .models import GivenPoint
-from .serializers import GivenPointArchivedSerializer
-from .exceptions import InvalidGivenPointsArchivedData
-from django.forms.models import model_to_dict
+from .models import GivenPoint, GivenPointArchived
+from .utils import record_tenant_change
 
 
 def validate_provisional_point_distribution(point_distribution, members_set):
+    """
+    Check that every member gave the same points to each member, archive what each member gave and keep only the
+    total of every member. The rows are written with a constant number of queries whatever the size of the team,
+    the caller batches the version bumps of the deleted rows.
+    """
     from_members = set()
     member_to_point = {}
     point_to_member = {}
-    given_points = point_distribution.given_points.all()
+    given_points = list(point_distribution.given_points.select_related('from_member', 'to_member'))
     for given_point in given_points:
         points = given_point.points
         to_member = given_point.to_member
@@ -27,28 +30,24 @@ def validate_provisional_point_distribution(point_distribution, members_set):
         raise MembersMissingException()
     if len(from_members) != len(members_set):
         raise NotAllMembersGavePointsException()
-    for given_point in given_points:
-        given_point_dict = model_to_dict(given_point)
-        del given_point_dict['point_distribution']
-        del given_point_dict['id']
-        serializer = GivenPointArchivedSerializer(data=given_point_dict)
-        if not serializer.is_valid():
-            raise InvalidGivenPointsArchivedData()
-        serializer.save()
-        given_point.delete()
-    sum_points = 0
+    if sum(member_to_point.values()) != 100:
+        raise InvalidSumPointsException()
+
     week = point_distribution.week
     instance_id = point_distribution.instance_id
-    entries = []
-    for member, points in member_to_point.items():
-        new_given_point_entry = GivenPoint(to_member=member, points=points,
-                                           point_distribution=point_distribution, week=week, instance_id=instance_id)
-        entries.append(new_given_point_entry)
-        sum_points += points
-    if sum_points != 100:
-        raise InvalidSumPointsException()
-    for entry in entries:
-        entry.save()
+    GivenPointArchived.objects.bulk_create([
+        GivenPointArchived(from_member=given_point.from_member, to_member=given_point.to_member,
+                           points=given_point.points, week=given_point.week, instance_id=given_point.instance_id)
+        for given_point in given_points
+    ])
+    point_distribution.given_points.all().delete()
+    GivenPoint.objects.bulk_create([
+        GivenPoint(to_member=member, points=points, point_distribution=point_distribution, week=week,
+                   instance_id=instance_id)
+        for member, points in member_to_point.items()
+    ])
+    # bulk_create sends no post_save
+    record_tenant_change(instance_id)
 
 
 def check_batch_includes_all_members(given_points, members_set):
@@ -67,3 +66,14 @@ def check_all_point_values_are_valid(given_points):
         points = given_point['points']
         if points > 100 or points < 0:
             raise PointValueNotValidException()
+
+
+def get_valid_point_values(members_count):
+    """
+    Distinct point values adding up to 100, one per member. No team of more than 14 members can have them.
+    """
+    values = list(range(members_count - 1))
+    values.append(100 - sum(values))
+    if len(set(values)) != members_count or values[-1] < 0:
+        raise ValueError("No valid distribution of 100 points for %s members" % members_count)
+    return values
@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.core import signing
+
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+# cProfile and pstats are imported when a profile is taken or read, most workers never need them
+
+HEADER = 'HTTP_X_PROFILE_TOKEN'
+SALT = 'core.profiling'
+
+_local = threading.local()
+_counter = itertools.count()
+
+
+def make_token():
+    """
+    Value of the X-Profile-Token header asking for a request to be profiled, valid for PROFILING_TOKEN_MAX_AGE
+    """
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def has_valid_token(request):
+    token = request.META.get(HEADER, '')
+    if token == '':
+        return False
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(request):
+    return has_valid_token(request) or random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def set_tenant(instance_id):
+    _local.tenant = instance_id
+
+
+def get_tenant():
+    return getattr(_local, 'tenant', None)
+
+
+def start():
+    _local.tenant = None
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save(profiler, info):
+    """
+    Write the stats of a profile and its annotations to PROFILING_DIR, the oldest profiles are deleted so that at most
+    PROFILING_MAX_FILES are kept
+    """
+    directory = settings.PROFILING_DIR
+    name = '{:016d}-{}-{}'.format(int(time.time() * 1000000), os.getpid(), next(_counter))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, name + '.prof'))
+        with open(os.path.join(directory, name + '.json'), 'w') as f:
+            json.dump(info, f)
+        prune(directory, settings.PROFILING_MAX_FILES)
+    except OSError as e:
+        logging.warning("Could not store profile %s: %s", name, e)
+        return None
+    return name
+
+
+def get_names(directory):
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    # The names start with the time, newest first
+    return sorted((f[:-len('.json')] for f in files if f.endswith('.json')), reverse=True)
+
+
+def prune(directory, max_files):
+    for name in get_names(directory)[max_files:]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                # Removed by another worker
+                pass
+
+
+def get_top_functions(path, top):
+    import pstats
+    stats = pstats.Stats(path).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{
+        'function': pstats.func_std_string(function),
+        'calls': calls,
+        'total_time': total_time,
+        'cumulative_time': cumulative_time,
+    } for function, (_, calls, total_time, cumulative_time, _) in functions]
+
+
+def list_profiles(limit, top):
+    """
+    Annotations of the latest profiles, each with its top functions by cumulative time
+    """
+    directory = settings.PROFILING_DIR
+    profiles = []
+    for name in get_names(directory)[:limit]:
+        try:
+            with open(os.path.join(directory, name + '.json')) as f:
+                info = json.load(f)
+            info['top_functions'] = get_top_functions(os.path.join(directory, name + '.prof'), top)
+        except (OSError, ValueError, EOFError):
+            # Pruned while being read or still being written
+            continue
+        info['name'] = name
+        profiles.append(info)
+    return profiles
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TenantDataVersion, TENANT_MODELS
+from .utils import bump_tenant_data_version
+
+# The data versions are kept and bumped instead of deleted, a version starting over would match the ETags cached
+# before the purge
+
+
+def delete_rows(model, database, instance_id=None):
+    """
+    Delete the rows of a tenant, or all of them, with a single statement. Unlike QuerySet.delete() no row is loaded
+    and no signal is sent.
+    """
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if instance_id is None:
+            cursor.execute('DELETE FROM %s' % quote(model._meta.db_table))
+        else:
+            cursor.execute('DELETE FROM %s WHERE %s = %%s' % (quote(model._meta.db_table), quote('instance_id')),
+                           [instance_id])
+        return cursor.rowcount
+
+
+def purge_tenant(instance_id, database):
+    """
+    Delete all the data of a tenant from its shard, returns the number of rows deleted per model
+    """
+    with transaction.atomic(using=database):
+        deleted = OrderedDict((model.__name__, delete_rows(model, database, instance_id)) for model in TENANT_MODELS)
+        bump_tenant_data_version(instance_id, database)
+    return deleted
+
+
+def truncate_tenants(database):
+    """
+    Delete the data of every tenant of a shard, meant for test environments. PostgreSQL empties the tables without
+    scanning them.
+    """
+    connection = connections[database]
+    tables = [model._meta.db_table for model in TENANT_MODELS]
+    with transaction.atomic(using=database):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('TRUNCATE %s' % ', '.join(connection.ops.quote_name(table) for table in tables))
+        else:
+            # SQLite has no TRUNCATE, a DELETE without WHERE empties the table at once
+            for model in TENANT_MODELS:
+                delete_rows(model, database)
+        TenantDataVersion.objects.using(database).update(version=F('version') + 1, modified=timezone.now())
+
+
+def truncate_all():
+    for database in settings.TENANT_SHARDS:
+        truncate_tenants(database)
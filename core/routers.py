@@ -0,0 +1,101 @@
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+_state = threading.local()
+_replica_health = {}
+
+REPLICA_LAG_SQL = 'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 ' \
+                  'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+
+
+def get_tenant_database():
+    return getattr(_state, 'database', None)
+
+
+def set_tenant_database(database):
+    _state.database = database
+
+
+def get_read_database():
+    return getattr(_state, 'read_database', None)
+
+
+def set_read_database(database):
+    _state.read_database = database
+
+
+def get_replica_lag(alias):
+    """
+    Replication lag of a replica in seconds, a replica that can not be reached is infinitely late
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError as e:
+        logging.warning("Could not check the lag of replica %s: %s", alias, e)
+        return float('inf')
+    return float(lag or 0)
+
+
+def is_replica_healthy(alias):
+    checked_at, healthy = _replica_health.get(alias, (None, True))
+    now = time.time()
+    if checked_at is None or now - checked_at >= settings.REPLICA_LAG_CHECK_SECONDS:
+        lag = get_replica_lag(alias)
+        healthy = lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logging.warning("Replica %s is %s seconds late, removing it from the rotation", alias, lag)
+        _replica_health[alias] = (now, healthy)
+    return healthy
+
+
+def get_primary(alias):
+    for primary, replicas in settings.DATABASE_REPLICAS.items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+def choose_replica(database):
+    replicas = [alias for alias in settings.DATABASE_REPLICAS.get(database, []) if is_replica_healthy(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+class TenantShardRouter(object):
+    """
+    Send the queries of the tenant models to the shard of the tenant being served, reads go to a replica when the
+    request picked one. The shard map itself and the other applications live on the default database.
+    """
+    @staticmethod
+    def is_tenant_model(app_label, model_name):
+        return app_label == 'core' and model_name != 'tenantshard'
+
+    def db_for_read(self, model, **hints):
+        if self.is_tenant_model(model._meta.app_label, model._meta.model_name):
+            return get_read_database() or get_tenant_database()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        if self.is_tenant_model(model._meta.app_label, model._meta.model_name):
+            return get_tenant_database()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A row read from a replica can be attached to a row of its primary
+        return get_primary(obj1._state.db) == get_primary(obj2._state.db)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if get_primary(db) != db:
+            return False
+        if db == 'default':
+            return True
+        return self.is_tenant_model(app_label, model_name)
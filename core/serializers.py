@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 
 from .models import Member, GivenPoint, GivenPointArchived, PointDistribution, Team
@@ -23,10 +25,36 @@ class MemberSerializer(serializers.ModelSerializer):
         return member
 
 
+class MemberIdentifierField(serializers.SlugRelatedField):
+    """
+    Member given by its identifier. With an identifier to member dictionary as 'members' in the context the members
+    are looked up there instead of with a query per field.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(slug_field='identifier', queryset=Member.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        members = self.context.get('members')
+        if members is None:
+            return super().to_internal_value(data)
+        try:
+            return members[data]
+        except KeyError:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+        except TypeError:
+            self.fail('invalid')
+
+
 class GivenPointSerializer(serializers.ModelSerializer):
+    to_member = MemberIdentifierField()
+    from_member = MemberIdentifierField(allow_null=True, required=False)
+
     class Meta:
         model = GivenPoint
         fields = ('to_member', 'points', 'from_member', 'week', 'instance_id')
+        # The unique together validator runs a query per point, the constraint of the table is checked anyway and
+        # SendPoints answers its IntegrityError with PointsAlreadySentException
+        validators = []
 
     def create(self, validated_data):
         given_point = GivenPoint.objects.create(**validated_data)
@@ -39,6 +67,9 @@ class GivenPointSerializer(serializers.ModelSerializer):
 
 
 class GivenPointArchivedSerializer(serializers.ModelSerializer):
+    to_member = MemberIdentifierField()
+    from_member = MemberIdentifierField(allow_null=True, required=False)
+
     class Meta:
         model = GivenPointArchived
         fields = ('from_member', 'to_member', 'points', 'week', 'instance_id')
@@ -57,7 +88,93 @@ class PointDistributionSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         given_points_data = validated_data.pop('given_points')
-        for given_point_data in given_points_data:
-            GivenPoint.objects.create(point_distribution=instance, **given_point_data)
+        GivenPoint.objects.bulk_create([GivenPoint(point_distribution=instance, **given_point_data)
+                                        for given_point_data in given_points_data])
+        # bulk_create sends no post_save, saving the distribution invalidates the ETags of the tenant
         instance.save()
         return instance
+
+
+class ValuesSerializer(object):
+    """
+    Read only serializer building the representation straight from values_list() rows, without model instances. The
+    output is the same as the one of the matching ModelSerializer.
+    """
+    fields = ()
+    date_fields = ()
+
+    def __init__(self, queryset, many=False):
+        self.queryset = queryset.prefetch_related(None)
+        self.many = many
+
+    def to_representation(self, row):
+        item = OrderedDict(zip([name for name, lookup in self.fields], row))
+        for name in self.date_fields:
+            if item[name] is not None:
+                item[name] = item[name].isoformat()
+        return item
+
+    def get_rows(self, *extra_lookups):
+        """
+        Pairs of the values of the extra lookups and the representation of every row
+        """
+        lookups = extra_lookups + tuple(lookup for name, lookup in self.fields)
+        for row in self.queryset.values_list(*lookups):
+            yield row[:len(extra_lookups)], self.to_representation(row[len(extra_lookups):])
+
+    def get_items(self):
+        return [item for _, item in self.get_rows()]
+
+    @property
+    def data(self):
+        items = self.get_items()
+        if self.many:
+            return items
+        if not items:
+            raise self.queryset.model.DoesNotExist()
+        return items[0]
+
+
+class MemberValuesSerializer(ValuesSerializer):
+    fields = (('name', 'name'), ('email', 'email'), ('instance_id', 'instance_id'), ('identifier', 'identifier'))
+
+
+class GivenPointValuesSerializer(ValuesSerializer):
+    fields = (('to_member', 'to_member__identifier'), ('points', 'points'),
+              ('from_member', 'from_member__identifier'), ('week', 'week'), ('instance_id', 'instance_id'))
+    date_fields = ('week',)
+
+
+class GivenPointArchivedValuesSerializer(ValuesSerializer):
+    fields = (('from_member', 'from_member__identifier'), ('to_member', 'to_member__identifier'),
+              ('points', 'points'), ('week', 'week'), ('instance_id', 'instance_id'))
+    date_fields = ('week',)
+
+
+class GivenPointArchivedSummaryValuesSerializer(ValuesSerializer):
+    """
+    Compacted weeks in the shape of the archived points, one row per member and week with what all the givers gave
+    """
+    fields = (('to_member', 'to_member__identifier'), ('points', 'points'), ('week', 'week'),
+              ('instance_id', 'instance_id'))
+    date_fields = ('week',)
+
+    def to_representation(self, row):
+        item = super().to_representation(row)
+        return OrderedDict([('from_member', None)] + list(item.items()))
+
+
+class PointDistributionValuesSerializer(ValuesSerializer):
+    fields = (('week', 'week'), ('date', 'date'), ('is_final', 'is_final'), ('instance_id', 'instance_id'),
+              ('identifier', 'identifier'))
+    date_fields = ('week', 'date')
+
+    def get_items(self):
+        rows = list(self.get_rows('id'))
+        given_points = dict((key[0], []) for key, item in rows)
+        if given_points:
+            # Same query as the prefetch of the given points
+            queryset = GivenPoint.objects.filter(point_distribution__in=list(given_points))
+            for key, given_point in GivenPointValuesSerializer(queryset).get_rows('point_distribution'):
+                given_points[key[0]].append(given_point)
+        return [OrderedDict([('given_points', given_points[key[0]])] + list(item.items())) for key, item in rows]
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_save, post_delete
+
+from .models import Member, PointDistribution, GivenPoint, GivenPointArchived, GivenPointArchivedSummary, Team
+from .utils import record_tenant_change
+
+VERSIONED_MODELS = (Team, Member, PointDistribution, GivenPoint, GivenPointArchived, GivenPointArchivedSummary)
+
+
+def tenant_data_changed(sender, instance, using, **kwargs):
+    """
+    Invalidate the ETags of a tenant whenever one of its rows changes
+    """
+    if instance.instance_id:
+        record_tenant_change(instance.instance_id, using)
+
+
+# Connected per model, a receiver for every sender would keep Django from fast deleting the other models
+for model in VERSIONED_MODELS:
+    post_save.connect(tenant_data_changed, sender=model)
+    post_delete.connect(tenant_data_changed, sender=model)
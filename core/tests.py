@@ -1,13 +1,66 @@
-from django.test import TestCase
-from django.db.utils import IntegrityError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command, CommandError
+from django.conf import settings
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.db.migrations.executor import MigrationExecutor
+from django.http import StreamingHttpResponse
+from django.db.utils import IntegrityError, OperationalError
 from rest_framework.test import APIRequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ParseError
 from datetime import date
+from decimal import Decimal
 import datetime
-from unittest import skip
+from unittest import skip, skipUnless, mock
+from io import StringIO, BytesIO
+import json
+import os
+import re
+import logging
+import gzip
+import msgpack
+import requests
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from django.contrib.auth.models import User
+from prometheus_client import REGISTRY
 
-from .models import Member, PointDistribution, GivenPoint, GivenPointArchived
+from .models import Member, PointDistribution, GivenPoint, GivenPointArchived, Team, TenantDataVersion, \
+    IdempotencyKey, GivenPointArchivedSummary, TenantShard
 from .views import PointDistributionHistory, PointDistributionWeek, MemberList, SendPoints, \
-    ValidateProvisionalPointDistribution
+    ValidateProvisionalPointDistribution, GivenPointsTeamTotal, TeamList, MemberPointsHistory, SendPointsBatch
+from .utils import concatenate_and_hash, get_given_point_models, get_points_distributions, get_tenant_shard, \
+    get_replica_database, run_in_transaction, batched_version_bumps, get_monday_from_date, get_tenant_data_version
+from .serializers import MemberSerializer, GivenPointArchivedSerializer, PointDistributionSerializer, \
+    MemberValuesSerializer, GivenPointArchivedValuesSerializer, PointDistributionValuesSerializer
+from .points_operation import get_valid_point_values
+from .management.commands.benchmark_lifecycle import StandInAdapter
+from .management.commands.partition_archived_points import add_months
+from .renderers import FastJSONRenderer
+from .exceptions import DependencyUnavailableException, PointsAlreadySentException
+from .log import BackgroundHandler, JSONFormatter, SamplingFilter
+from .parsers import FastJSONParser
+from .purge import truncate_all
+from . import routers, outbound, middleware, metrics, profiling
+from pointdistribution import gunicorn_conf
+
+# No test sends its notifications to the Slackbot of SLACKBOT_URL, the tests of the background calls use the original
+send_in_background = outbound.send_in_background
+background_patcher = mock.patch('core.outbound.send_in_background')
+
+
+def setUpModule():
+    background_patcher.start()
+
+
+def tearDownModule():
+    background_patcher.stop()
 
 # TEST MODELS
 
@@ -489,3 +542,1348 @@ class ValidateProvisionalPointDistributionTest(TestCase):
         response = ValidateProvisionalPointDistribution.as_view()(request)
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data, {'detail': "Not all members gave points to their colleagues"})
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.entry1 = Member(name="Name1", email="name1@email.com", instance_id="1234",
+                             identifier="82e37e019472168a59a6d959936e6aa7")
+        self.entry1.save()
+
+    def test_etag_is_returned(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234')
+        response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_matching_etag_returns_304(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234')
+        etag = GivenPointsTeamTotal.as_view()(request)['ETag']
+        request = self.factory.get('/v1/team/points/?instance_id=1234', HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(1):
+            response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_after_write(self):
+        request = self.factory.get('/v1/points/distribution/history/?instance_id=1234')
+        etag = PointDistributionHistory.as_view()(request)['ETag']
+        PointDistribution(week="1970-01-05", date="1970-01-05", is_final=True, instance_id="1234").save()
+        request = self.factory.get('/v1/points/distribution/history/?instance_id=1234', HTTP_IF_NONE_MATCH=etag)
+        response = PointDistributionHistory.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 1)
+
+    def test_etag_is_scoped_to_tenant(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234')
+        etag = GivenPointsTeamTotal.as_view()(request)['ETag']
+        Member(name="Name2", email="name2@email.com", instance_id="5678",
+               identifier="c0e1a4f9e49d4bcb0a1a1cbb1bbd9e8b").save()
+        request = self.factory.get('/v1/team/points/?instance_id=1234', HTTP_IF_NONE_MATCH=etag)
+        response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_format(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234')
+        etag = GivenPointsTeamTotal.as_view()(request)['ETag']
+        request = self.factory.get('/v1/team/points/?instance_id=1234', HTTP_ACCEPT='application/msgpack',
+                                   HTTP_IF_NONE_MATCH=etag)
+        response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class QueryPlanTest(TestCase):
+    """
+    Run every endpoint against a synthetic multi-tenant dataset and check the plan of each filtered query
+    """
+    TENANTS = 10
+    MEMBERS = 8
+    WEEKS = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        first_monday = date(2017, 1, 2)
+        instance_ids = [str(1000 + tenant) for tenant in range(cls.TENANTS)]
+        emails = ["member%s@email.com" % idx for idx in range(cls.MEMBERS)]
+        Team.objects.bulk_create(Team(instance_id=instance_id, instance_name="team" + instance_id)
+                                 for instance_id in instance_ids)
+        Member.objects.bulk_create(Member(name=email, email=email, instance_id=instance_id,
+                                          identifier=concatenate_and_hash(email, instance_id))
+                                   for instance_id in instance_ids for email in emails)
+        distributions = []
+        for instance_id in instance_ids:
+            for week_idx in range(cls.WEEKS):
+                week = first_monday + datetime.timedelta(weeks=week_idx)
+                distributions.append(PointDistribution(identifier=concatenate_and_hash(week, instance_id), week=week,
+                                                       date=week, is_final=week_idx < cls.WEEKS - 1,
+                                                       instance_id=instance_id))
+        PointDistribution.objects.bulk_create(distributions)
+        member_ids = dict(Member.objects.values_list('identifier', 'id'))
+        distribution_ids = dict(PointDistribution.objects.values_list('identifier', 'id'))
+        given_points, archived = [], []
+        for distribution in distributions:
+            instance_id = distribution.instance_id
+            for from_email in emails:
+                for to_email in emails:
+                    entry = dict(from_member_id=member_ids[concatenate_and_hash(from_email, instance_id)],
+                                 to_member_id=member_ids[concatenate_and_hash(to_email, instance_id)],
+                                 points=1, week=distribution.week, instance_id=instance_id)
+                    if distribution.is_final:
+                        archived.append(GivenPointArchived(**entry))
+                    else:
+                        given_points.append(GivenPoint(point_distribution_id=distribution_ids[distribution.identifier],
+                                                       **entry))
+            if distribution.is_final:
+                # Validated weeks only keep the total of each member
+                for to_email in emails:
+                    given_points.append(GivenPoint(point_distribution_id=distribution_ids[distribution.identifier],
+                                                   to_member_id=member_ids[concatenate_and_hash(to_email, instance_id)],
+                                                   points=cls.MEMBERS, week=distribution.week,
+                                                   instance_id=instance_id))
+        GivenPoint.objects.bulk_create(given_points)
+        GivenPointArchived.objects.bulk_create(archived)
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.instance_id = str(1000 + self.TENANTS // 2)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            if connection.vendor == 'postgresql':
+                # Small tables would legitimately be scanned, only report scans no index could avoid
+                cursor.execute('SET enable_seqscan = off')
+
+    @staticmethod
+    def explain(sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN ' + sql)
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @staticmethod
+    def is_sequential_scan(line):
+        if connection.vendor == 'postgresql':
+            return 'Seq Scan' in line
+        return re.match(r'SCAN (TABLE )?\w+$', line) is not None
+
+    def assert_no_sequential_scan(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        self.assertTrue(len(context.captured_queries) > 0)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or ' WHERE ' not in sql:
+                continue
+            plan = self.explain(sql)
+            for line in plan:
+                self.assertFalse(self.is_sequential_scan(line),
+                                 "Sequential scan in plan of %s:\n%s" % (sql, '\n'.join(plan)))
+        return result
+
+    def test_team(self):
+        request = self.factory.get('/v1/teams/team/?instance_id=%s' % self.instance_id)
+        response = self.assert_no_sequential_scan(TeamList.as_view(), request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_member_history(self):
+        request = self.factory.get('/v1/member/history/member1@email.com/?instance_id=%s' % self.instance_id)
+        response = self.assert_no_sequential_scan(MemberPointsHistory.as_view(), request, email='member1@email.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), self.MEMBERS * (self.WEEKS - 1))
+
+    def test_team_total(self):
+        request = self.factory.get('/v1/team/points/?instance_id=%s' % self.instance_id)
+        response = self.assert_no_sequential_scan(GivenPointsTeamTotal.as_view(), request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_point_distribution_history(self):
+        request = self.factory.get('/v1/points/distribution/history/?instance_id=%s' % self.instance_id)
+        response = self.assert_no_sequential_scan(PointDistributionHistory.as_view(), request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), self.WEEKS - 1)
+
+    def test_point_distribution_week(self):
+        request = self.factory.get('/v1/points/distribution/2017-01-02/?instance_id=%s' % self.instance_id)
+        response = self.assert_no_sequential_scan(PointDistributionWeek.as_view(), request, week='2017-01-02')
+        self.assertEqual(response.status_code, 200)
+
+    def test_validate_lookups(self):
+        week = date(2017, 1, 2) + datetime.timedelta(weeks=self.WEEKS - 1)
+        point_distribution = self.assert_no_sequential_scan(
+            ValidateProvisionalPointDistribution.get_point_distribution, week, self.instance_id)
+        self.assert_no_sequential_scan(lambda: list(point_distribution.given_points.all()))
+
+    def test_send_points_lookups(self):
+        week = date(2017, 1, 2) + datetime.timedelta(weeks=self.WEEKS - 1)
+        given_points = [{'from_member': 'member0@email.com', 'to_member': 'member1@email.com'}]
+        self.assert_no_sequential_scan(get_given_point_models, given_points, week, self.instance_id)
+        self.assert_no_sequential_scan(get_points_distributions, week, self.instance_id)
+
+
+class WeekRangeTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.entry1 = Member(name="Name1", email="name1@email.com", instance_id="1234",
+                             identifier="82e37e019472168a59a6d959936e6aa7")
+        self.entry1.save()
+        for week, points in (("2017-01-02", 40), ("2017-01-09", 60)):
+            GivenPointArchived(to_member=self.entry1, from_member=self.entry1, points=points, week=week,
+                               instance_id="1234").save()
+
+    def test_member_history_week_range(self):
+        request = self.factory.get('/v1/member/history/name1@email.com/?instance_id=1234&from_week=2017-01-09')
+        response = MemberPointsHistory.as_view()(request, email='name1@email.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([given_point['points'] for given_point in response.data], [60])
+
+    def test_team_total_week_range(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234&to_week=2017-01-02')
+        response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.data, {'Name1': 40})
+
+    def test_invalid_week(self):
+        request = self.factory.get('/v1/team/points/?instance_id=1234&to_week=2017-13-02')
+        response = GivenPointsTeamTotal.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+    def test_partition_command_without_postgres(self):
+        out = StringIO()
+        call_command('partition_archived_points', stdout=out)
+        self.assertIn('single table', out.getvalue())
+
+
+@skipUnless(len(settings.TENANT_SHARDS) > 1, 'Set DB_SHARDS to run the shard tests')
+class ShardRoutingTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        request = self.factory.post('/v1/members/', {"name": "Name", "email": "name@email.com", "instance_id": "1234"})
+        self.assertEqual(MemberList.as_view()(request).status_code, 200)
+        self.source = get_tenant_shard('1234').database
+
+    def test_member_created_on_tenant_shard(self):
+        for database in settings.TENANT_SHARDS:
+            self.assertEqual(Member.objects.using(database).filter(instance_id='1234').exists(),
+                             database == self.source)
+
+    def test_read_does_not_save_the_placement(self):
+        request = self.factory.get('/v1/teams/team/?instance_id=unknown')
+        self.assertEqual(TeamList.as_view()(request).status_code, 404)
+        self.assertFalse(TenantShard.objects.filter(instance_id='unknown').exists())
+        self.assertEqual(get_tenant_shard('unknown').database, get_tenant_shard('unknown', create=True).database)
+        self.assertTrue(TenantShard.objects.filter(instance_id='unknown').exists())
+
+    def test_move_tenant(self):
+        member = Member.objects.using(self.source).get(instance_id='1234')
+        for week in ("2017-01-02", "2017-01-09", "2017-01-16"):
+            GivenPointArchived.objects.using(self.source).create(to_member=member, from_member=member, points=100,
+                                                                 week=week, instance_id="1234")
+        IdempotencyKey.objects.using(self.source).create(instance_id='1234', key='key', fingerprint='fingerprint',
+                                                         status_code=200, body='{}')
+        target = [database for database in settings.TENANT_SHARDS if database != self.source][0]
+        call_command('move_tenant', '1234', target, grace=0, batch_size=2, stdout=StringIO())
+        self.assertEqual(get_tenant_shard('1234').database, target)
+        self.assertFalse(Member.objects.using(self.source).filter(instance_id='1234').exists())
+        self.assertEqual(IdempotencyKey.objects.using(target).get(instance_id='1234').key, 'key')
+        request = self.factory.get('/v1/member/history/name@email.com/?instance_id=1234')
+        response = MemberPointsHistory.as_view()(request, email='name@email.com')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([given_point['points'] for given_point in response.data], [100, 100, 100])
+
+    def test_move_tenant_keeps_source_until_map_saved(self):
+        target = [database for database in settings.TENANT_SHARDS if database != self.source][0]
+        save = TenantShard.save
+
+        def lose_unlock(shard, *args, **kwargs):
+            # Only the lock reaches the shard map, as if the process died before saving the new shard
+            if shard.is_locked:
+                save(shard, *args, **kwargs)
+
+        with mock.patch.object(TenantShard, 'save', autospec=True, side_effect=lose_unlock):
+            with self.assertRaises(CommandError):
+                call_command('move_tenant', '1234', target, grace=0, stdout=StringIO())
+        self.assertTrue(Member.objects.using(self.source).filter(instance_id='1234').exists())
+
+
+class TenantLockTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        locked = TenantShard(instance_id='1234', database='default', is_locked=True)
+        patcher = mock.patch('core.views.get_tenant_shard', return_value=locked)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_member_import_refused_while_moving(self):
+        request = self.factory.get('/v1/members/?instance_id=1234&instance_name=1234&user_email=name@email.com')
+        self.assertEqual(MemberList.as_view()(request).status_code, 503)
+        self.assertFalse(Team.objects.filter(instance_id='1234').exists())
+
+    def test_reads_served_while_moving(self):
+        Team.objects.create(instance_id='1234', instance_name='1234')
+        request = self.factory.get('/v1/teams/team/?instance_id=1234')
+        self.assertEqual(TeamList.as_view()(request).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS={'default': ['default']})
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        routers._replica_health.clear()
+        Member(name="Name1", email="name1@email.com", instance_id="1234",
+               identifier="82e37e019472168a59a6d959936e6aa7").save()
+
+    def test_recent_write_reads_from_primary(self):
+        self.assertIsNone(get_replica_database('1234'))
+
+    def test_idle_tenant_reads_from_replica(self):
+        TenantDataVersion.objects.filter(instance_id='1234').update(
+            modified=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(get_replica_database('1234'), 'default')
+        self.assertEqual(get_replica_database('5678'), 'default')
+
+    def test_replica_behind_the_tenant_is_not_used(self):
+        TenantDataVersion.objects.filter(instance_id='1234').update(
+            modified=timezone.now() - datetime.timedelta(hours=1))
+        version = get_tenant_data_version('1234')
+        with mock.patch('core.utils.get_tenant_data_version', return_value=version - 1):
+            self.assertIsNone(get_replica_database('1234'))
+
+    def test_lagging_replica_is_removed(self):
+        with mock.patch('core.routers.get_replica_lag', return_value=60):
+            self.assertIsNone(routers.choose_replica('default'))
+        with mock.patch('core.routers.get_replica_lag', return_value=0):
+            # The result of the last check is kept until the next one is due
+            self.assertIsNone(routers.choose_replica('default'))
+
+
+class SubmissionConcurrencyTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        Member(name="Name1", email="name1@email.com", instance_id="1234",
+               identifier="82e37e019472168a59a6d959936e6aa7").save()
+        self.today = date.today().isoformat()
+        self.distr = {
+            'given_points': [
+                {
+                    'from_member': 'name1@email.com',
+                    'to_member': 'name1@email.com',
+                    'points': 100,
+                    'instance_id': "1234"
+                }
+            ],
+            'date': self.today,
+            'instance_id': "1234"
+        }
+
+    def test_points_sent_twice_return_400(self):
+        request = self.factory.post('/v1/points/distribution/send/', self.distr, format='json')
+        self.assertEqual(SendPoints.as_view()(request).status_code, 200)
+        request = self.factory.post('/v1/points/distribution/send/', self.distr, format='json')
+        response = SendPoints.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(GivenPoint.objects.count(), 1)
+
+    def test_interleaved_submissions(self):
+        # The second submission is checked and written while the first one, checked already, waits to write
+        responses = []
+        writes = []
+
+        def write_after_second_submission(func, *args, **kwargs):
+            writes.append(func)
+            if len(writes) == 1:
+                request = self.factory.post('/v1/points/distribution/send/', self.distr, format='json')
+                responses.append(SendPoints.as_view()(request))
+            return run_in_transaction(func, *args, **kwargs)
+
+        with mock.patch('core.views.run_in_transaction', side_effect=write_after_second_submission):
+            request = self.factory.post('/v1/points/distribution/send/', self.distr, format='json')
+            responses.append(SendPoints.as_view()(request))
+
+        self.assertEqual([response.status_code for response in responses], [200, 400])
+        self.assertEqual(responses[1].data, {'detail': PointsAlreadySentException.default_detail})
+        self.assertEqual(GivenPoint.objects.count(), 1)
+
+    def test_points_sent_to_final_distribution_return_400(self):
+        monday = date.today() - datetime.timedelta(days=date.today().weekday())
+        PointDistribution(identifier=concatenate_and_hash(monday.strftime('%Y-%m-%d'), "1234"), week=monday,
+                          date=monday, is_final=True, instance_id="1234").save()
+        request = self.factory.post('/v1/points/distribution/send/', self.distr, format='json')
+        response = SendPoints.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'detail': "The point distribution of this week has already been validated"})
+
+
+class SendPointsBatchTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        for email, instance_id in (('name1@email.com', '1234'), ('name2@email.com', '1234'),
+                                   ('name3@email.com', '5678')):
+            Member(name=email, email=email, instance_id=instance_id,
+                   identifier=concatenate_and_hash(email, instance_id)).save()
+        self.today = date.today().isoformat()
+
+    def distribution(self, from_member, points, instance_id='1234', day=None):
+        return {
+            'given_points': [{'from_member': from_member, 'to_member': to_member, 'points': value,
+                              'instance_id': instance_id} for to_member, value in points],
+            'date': day or self.today,
+            'instance_id': instance_id,
+        }
+
+    def post(self, distributions):
+        request = self.factory.post('/v1/points/distribution/send/batch/', {'distributions': distributions},
+                                    format='json')
+        return SendPointsBatch.as_view()(request)
+
+    def test_several_members_and_teams(self):
+        points = [('name1@email.com', 60), ('name2@email.com', 40)]
+        response = self.post([self.distribution('name1@email.com', points),
+                              self.distribution('name2@email.com', points),
+                              self.distribution('name3@email.com', [('name3@email.com', 100)], '5678')])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 200, 200])
+        self.assertEqual(response.data['results'][0]['given_points'][0]['to_member'], 'name1@email.com')
+        self.assertEqual(GivenPoint.objects.filter(instance_id='1234').count(), 4)
+        self.assertEqual(GivenPoint.objects.filter(instance_id='5678').count(), 1)
+        self.assertEqual(PointDistribution.objects.count(), 2)
+
+    def test_invalid_distributions_are_left_out(self):
+        points = [('name1@email.com', 60), ('name2@email.com', 40)]
+        last_week = (date.today() - datetime.timedelta(weeks=1)).isoformat()
+        response = self.post([self.distribution('name1@email.com', points),
+                              self.distribution('name1@email.com', points),
+                              self.distribution('name2@email.com', points[:1]),
+                              self.distribution('name2@email.com', [('name1@email.com', 60),
+                                                                    ('name2@email.com', 140)]),
+                              self.distribution('name3@email.com', [('name3@email.com', 100)], '5678', last_week),
+                              {'date': self.today}])
+        self.assertEqual([result['status'] for result in response.data['results']], [200, 400, 400, 400, 400, 400])
+        self.assertEqual(response.data['results'][1]['detail'], "A member already sent points this week")
+        self.assertEqual(response.data['results'][2]['detail'], "Some members haven't been graded yet")
+        self.assertEqual(GivenPoint.objects.count(), 2)
+
+    def test_points_already_sent(self):
+        points = [('name1@email.com', 60), ('name2@email.com', 40)]
+        self.post([self.distribution('name1@email.com', points)])
+        response = self.post([self.distribution('name1@email.com', points),
+                              self.distribution('name2@email.com', points)])
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 200])
+        self.assertEqual(GivenPoint.objects.count(), 4)
+
+    def test_final_distribution(self):
+        monday = date.today() - datetime.timedelta(days=date.today().weekday())
+        PointDistribution(identifier=concatenate_and_hash(monday.strftime('%Y-%m-%d'), '1234'), week=monday,
+                          date=monday, is_final=True, instance_id='1234').save()
+        response = self.post([self.distribution('name1@email.com', [('name1@email.com', 60),
+                                                                    ('name2@email.com', 40)]),
+                              self.distribution('name3@email.com', [('name3@email.com', 100)], '5678')])
+        self.assertEqual([result['status'] for result in response.data['results']], [400, 200])
+        self.assertEqual(response.data['results'][0]['detail'],
+                         "The point distribution of this week has already been validated")
+
+    def test_malformed_batch(self):
+        request = self.factory.post('/v1/points/distribution/send/batch/', {'given_points': []}, format='json')
+        self.assertEqual(SendPointsBatch.as_view()(request).status_code, 400)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Moves the test database to a migration and back to the latest ones when the test is done
+    """
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class SurrogateKeyMigrationTest(MigrationTestCase):
+    """
+    The integer surrogate keys migration rewrites the foreign keys both ways
+    """
+    def test_migrate_back_to_hash_keys(self):
+        hashed = [('core', '0004_tenant_indexes')]
+        apps = self.migrate(hashed)
+        member = apps.get_model('core', 'Member').objects.create(identifier='m1', name='Name1',
+                                                                 email='name1@email.com', instance_id='1234')
+        distribution = apps.get_model('core', 'PointDistribution').objects.create(
+            identifier='d1', week='2017-01-02', date='2017-01-02', is_final=True, instance_id='1234')
+        apps.get_model('core', 'GivenPoint').objects.create(
+            id=7, from_member=member, to_member=member, point_distribution=distribution, points=100, week='2017-01-02',
+            instance_id='1234')
+        apps.get_model('core', 'GivenPointArchived').objects.create(
+            id=9, from_member=None, to_member=member, points=100, week='2017-01-02', instance_id='1234')
+
+        apps = self.migrate([('core', '0005_integer_surrogate_keys')])
+        member_id = apps.get_model('core', 'Member').objects.get(identifier='m1').id
+        self.assertEqual(apps.get_model('core', 'GivenPoint').objects.get(id=7).to_member_id, member_id)
+
+        apps = self.migrate(hashed)
+        given_point = apps.get_model('core', 'GivenPoint').objects.get(id=7)
+        self.assertEqual((given_point.from_member_id, given_point.to_member_id, given_point.point_distribution_id),
+                         ('m1', 'm1', 'd1'))
+        archived = apps.get_model('core', 'GivenPointArchived').objects.get(id=9)
+        self.assertEqual((archived.from_member_id, archived.to_member_id), (None, 'm1'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The archived points are only partitioned on PostgreSQL')
+class PartitionArchivedPointsTest(MigrationTestCase):
+    """
+    The archive migration and the partition command against a real partitioned table
+    """
+    table = GivenPointArchived._meta.db_table
+
+    def get_relkind(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s', [self.table])
+            return cursor.fetchone()[0]
+
+    def get_rows_per_partition(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text, COUNT(*) FROM %s GROUP BY 1' % self.table)
+            return dict(cursor.fetchall())
+
+    def test_partition_archived_points(self):
+        current_month = date.today().replace(day=1)
+        old_month = add_months(current_month, -2)
+
+        apps = self.migrate([('core', '0005_integer_surrogate_keys')])
+        self.assertEqual(self.get_relkind(), 'r')
+        member = apps.get_model('core', 'Member').objects.create(identifier='m1', name='Name1',
+                                                                 email='name1@email.com', instance_id='1234')
+        for week in (old_month, current_month):
+            apps.get_model('core', 'GivenPointArchived').objects.create(
+                from_member=None, to_member=member, points=100, week=week, instance_id='1234')
+
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        self.assertEqual(self.get_relkind(), 'p')
+        self.assertEqual(self.get_rows_per_partition(), {self.table + '_default': 2})
+
+        out = StringIO()
+        call_command('partition_archived_points', stdout=out)
+        for month in (old_month, add_months(old_month, 1), current_month, add_months(current_month, 3)):
+            self.assertIn('Created partition %s_y%04dm%02d' % (self.table, month.year, month.month), out.getvalue())
+        self.assertEqual(self.get_rows_per_partition(), {
+            '%s_y%04dm%02d' % (self.table, old_month.year, old_month.month): 1,
+            '%s_y%04dm%02d' % (self.table, current_month.year, current_month.month): 1,
+        })
+
+        next_month = add_months(current_month, 1)
+        GivenPointArchived.objects.create(from_member=None, to_member_id=member.id, points=50, week=next_month,
+                                          instance_id='1234')
+        self.assertEqual(self.get_rows_per_partition()['%s_y%04dm%02d' % (
+            self.table, next_month.year, next_month.month)], 1)
+
+        call_command('partition_archived_points', retain_months=1, drop=True, stdout=StringIO())
+        self.assertEqual(sorted(GivenPointArchived.objects.values_list('week', flat=True)),
+                         [current_month, next_month])
+
+        self.migrate([('core', '0005_integer_surrogate_keys')])
+        self.assertEqual(self.get_relkind(), 'r')
+        self.assertEqual(self.get_rows_per_partition(), {self.table: 2})
+
+
+class RunInTransactionTest(TransactionTestCase):
+    def test_retries_locked_database(self):
+        calls = []
+
+        def submit():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(run_in_transaction(submit, backoff=0), 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_attempts_are_bounded(self):
+        calls = []
+
+        def submit():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        self.assertRaises(OperationalError, run_in_transaction, submit, attempts=2, backoff=0)
+        self.assertEqual(len(calls), 2)
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        Member(name="Name1", email="name1@email.com", instance_id="1234",
+               identifier="82e37e019472168a59a6d959936e6aa7").save()
+        self.distr = {
+            'given_points': [
+                {
+                    'from_member': 'name1@email.com',
+                    'to_member': 'name1@email.com',
+                    'points': 100,
+                    'instance_id': "1234"
+                }
+            ],
+            'date': date.today().isoformat(),
+            'instance_id': "1234"
+        }
+
+    def send(self, distr):
+        request = self.factory.post('/v1/points/distribution/send/', distr, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        return SendPoints.as_view()(request)
+
+    def test_retry_replays_response(self):
+        first = self.send(self.distr)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(1):
+            retry = self.send(self.distr)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, json.loads(json.dumps(first.data)))
+        self.assertEqual(GivenPoint.objects.count(), 1)
+
+    def test_key_reused_for_other_request(self):
+        self.send(self.distr)
+        self.distr['given_points'][0]['points'] = 99
+        self.assertEqual(self.send(self.distr).status_code, 422)
+
+    def test_raised_client_error_replayed(self):
+        self.distr['given_points'][0]['to_member'] = 'unknown@email.com'
+        first = self.send(self.distr)
+        self.assertEqual(first.status_code, 400)
+        retry = self.send(self.distr)
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, json.loads(json.dumps(first.data)))
+
+    def test_returned_client_error_replayed(self):
+        invalid = mock.Mock(errors={'given_points': ['Invalid']})
+        with mock.patch.object(SendPoints, 'submit_points', return_value=invalid):
+            first = self.send(self.distr)
+        self.assertEqual(first.status_code, 400)
+        retry = self.send(self.distr)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, json.loads(json.dumps(first.data)))
+
+    def test_server_error_releases_key(self):
+        with mock.patch.object(SendPoints, 'submit_points', side_effect=DependencyUnavailableException()):
+            self.assertEqual(self.send(self.distr).status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.send(self.distr).status_code, 200)
+
+    def test_stale_claim_taken_over(self):
+        # The worker of the first request died before the points were written and the response stored
+        self.send(self.distr)
+        GivenPoint.objects.all().delete()
+        IdempotencyKey.objects.update(status_code=None, body='')
+        self.assertEqual(self.send(self.distr).status_code, 409)
+        IdempotencyKey.objects.update(created=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(self.send(self.distr).status_code, 200)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 200)
+
+    def test_body_not_an_object(self):
+        request = self.factory.post('/v1/points/distribution/send/', [self.distr], format='json',
+                                    HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(SendPoints.as_view()(request).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_evict_expired_keys(self):
+        self.send(self.distr)
+        IdempotencyKey.objects.update(created=timezone.now() - datetime.timedelta(days=2))
+        call_command('evict_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class OutboundTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        Member(name="Name1", email="name1@email.com", instance_id="1234",
+               identifier="82e37e019472168a59a6d959936e6aa7").save()
+
+    def test_send_points_notifies_slackbot_in_background(self):
+        distr = {
+            'given_points': [
+                {'from_member': 'name1@email.com', 'to_member': 'name1@email.com', 'points': 100,
+                 'instance_id': "1234"}
+            ],
+            'date': date.today().isoformat(),
+            'instance_id': "1234"
+        }
+        with mock.patch('core.views.outbound.send_in_background') as send_in_background:
+            request = self.factory.post('/v1/points/distribution/send/', distr, format='json')
+            response = SendPoints.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send_in_background.call_count, 1)
+        self.assertEqual(send_in_background.call_args[0][0], outbound.SLACKBOT)
+
+    def test_gather_keeps_order(self):
+        with mock.patch('core.outbound.request', side_effect=lambda dependency, method, url, **kwargs: url):
+            responses = outbound.gather([(outbound.VSTS, 'get', str(i), {}) for i in range(20)])
+        self.assertEqual(responses, [str(i) for i in range(20)])
+
+
+class GunicornConfigTest(TestCase):
+    def test_profile_follows_workload(self):
+        self.assertEqual(gunicorn_conf.get_profile(4, 'cpu', True), ('sync', 9, 1))
+        self.assertEqual(gunicorn_conf.get_profile(4, 'mixed', True), ('gthread', 5, 4))
+        self.assertEqual(gunicorn_conf.get_profile(4, 'io', True), ('gevent', 4, 1))
+        self.assertEqual(gunicorn_conf.get_profile(4, 'io', True, green=False), ('gthread', 5, 16))
+
+    def test_sync_workers_without_outbound_endpoints(self):
+        self.assertEqual(gunicorn_conf.get_profile(2, 'io', False), ('sync', 5, 1))
+
+
+class StartupTest(TestCase):
+    # Loaded on first use, requests is not listed as the API schema support of rest_framework imports it
+    LAZY_MODULES = ('prometheus_client', 'cProfile', 'pstats', 'concurrent.futures')
+
+    def test_lazy_modules_not_loaded_on_startup(self):
+        script = '\n'.join([
+            'import json, sys',
+            'from django.core.wsgi import get_wsgi_application',
+            'get_wsgi_application()',
+            'from django.urls import get_resolver',
+            'get_resolver().url_patterns',
+            'print(json.dumps([module for module in %r if module in sys.modules]))' % (self.LAZY_MODULES,),
+        ])
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=settings.BASE_DIR)
+        self.assertEqual(json.loads(output.decode().splitlines()[-1]), [])
+
+    def test_startup_report(self):
+        out = StringIO()
+        # The time depends on the machine, only the report is checked
+        call_command('benchmark_startup', budget=float('inf'), stdout=out)
+        self.assertIn('Startup took', out.getvalue())
+
+
+class FastJSONTest(TestCase):
+    def test_same_output_as_json_renderer(self):
+        data = {
+            'week': date(2017, 1, 2),
+            'modified': datetime.datetime(2017, 1, 2, 10, 30, 15, 123456, tzinfo=timezone.utc),
+            'average': Decimal('10.5'),
+            'name': 'Zo\u00eb \u2028\u2029',
+            1: [None, True, 1.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render([10 ** 30]), JSONRenderer().render([10 ** 30]))
+
+    def test_parse(self):
+        stream = BytesIO('{"points": [1, 2.5], "name": "Zo\u00eb"}'.encode('utf-8'))
+        self.assertEqual(FastJSONParser().parse(stream), {'points': [1, 2.5], 'name': 'Zo\u00eb'})
+
+    def test_parse_error(self):
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"points": '))
+
+
+class MessagePackTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        Member(name="Name1", email="name1@email.com", instance_id="1234",
+               identifier="82e37e019472168a59a6d959936e6aa7").save()
+        self.distr = {
+            'given_points': [
+                {'from_member': 'name1@email.com', 'to_member': 'name1@email.com', 'points': 100,
+                 'instance_id': "1234"}
+            ],
+            'date': date.today().isoformat(),
+            'instance_id': "1234"
+        }
+
+    def test_send_points_in_msgpack(self):
+        request = self.factory.post('/v1/points/distribution/send/', msgpack.packb(self.distr, use_bin_type=True),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        response = SendPoints.as_view()(request)
+        response.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), json.loads(json.dumps(response.data)))
+        self.assertEqual(GivenPoint.objects.count(), 1)
+
+    def test_json_stays_default(self):
+        SendPoints.as_view()(self.factory.post('/v1/points/distribution/send/', self.distr, format='json'))
+        PointDistribution.objects.update(is_final=True)
+        responses = []
+        for accept in ('application/msgpack', '*/*'):
+            request = self.factory.get('/v1/points/distribution/history/?instance_id=1234', HTTP_ACCEPT=accept)
+            responses.append(PointDistributionHistory.as_view()(request).render())
+        self.assertEqual(responses[1]['Content-Type'], 'application/json')
+        self.assertEqual(msgpack.unpackb(responses[0].content, raw=False), json.loads(responses[1].content.decode()))
+        self.assertLess(len(responses[0].content), len(responses[1].content))
+
+    def test_parse_error(self):
+        request = self.factory.post('/v1/points/distribution/send/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(SendPoints.as_view()(request).status_code, 400)
+
+
+class ValuesSerializerTest(TestCase):
+    def setUp(self):
+        members = [Member.objects.create(name="Name{}".format(i), email="name{}@email.com".format(i),
+                                         instance_id="1234", identifier="identifier{}".format(i)) for i in range(2)]
+        for week in ('2017-01-02', '2017-01-09'):
+            distribution = PointDistribution.objects.create(identifier=week, week=week, date=week, is_final=True,
+                                                            instance_id="1234")
+            GivenPoint.objects.create(from_member=members[0], to_member=members[1], points=100,
+                                      point_distribution=distribution, week=week, instance_id="1234")
+            GivenPoint.objects.create(from_member=None, to_member=members[0], points=0,
+                                      point_distribution=distribution, week=week, instance_id="1234")
+            GivenPointArchived.objects.create(from_member=members[0], to_member=members[1], points=100, week=week,
+                                              instance_id="1234")
+            GivenPointArchived.objects.create(from_member=None, to_member=members[1], points=50, week=week,
+                                              instance_id="1234")
+
+    def assertSameOutput(self, model_serializer, values_serializer):
+        self.assertEqual(JSONRenderer().render(values_serializer.data), JSONRenderer().render(model_serializer.data))
+
+    def test_same_output_as_model_serializers(self):
+        self.assertSameOutput(MemberSerializer(Member.objects.all(), many=True),
+                              MemberValuesSerializer(Member.objects.all(), many=True))
+        self.assertSameOutput(GivenPointArchivedSerializer(GivenPointArchived.objects.all(), many=True),
+                              GivenPointArchivedValuesSerializer(GivenPointArchived.objects.all(), many=True))
+        self.assertSameOutput(PointDistributionSerializer(PointDistribution.objects.all(), many=True),
+                              PointDistributionValuesSerializer(PointDistribution.objects.all(), many=True))
+        self.assertSameOutput(PointDistributionSerializer(PointDistribution.objects.get(week='2017-01-09')),
+                              PointDistributionValuesSerializer(PointDistribution.objects.filter(week='2017-01-09')))
+
+    def test_history_queries(self):
+        with self.assertNumQueries(2):
+            PointDistributionValuesSerializer(PointDistribution.objects.all(), many=True).data
+
+    def test_missing_object(self):
+        with self.assertRaises(PointDistribution.DoesNotExist):
+            PointDistributionValuesSerializer(PointDistribution.objects.filter(week='2016-01-04')).data
+
+
+class CompressionTest(TestCase):
+    url = '/v1/points/distribution/history/?instance_id=1234'
+
+    def setUp(self):
+        member = Member.objects.create(name="Name1", email="name1@email.com", instance_id="1234",
+                                       identifier="82e37e019472168a59a6d959936e6aa7")
+        for i in range(20):
+            week = datetime.date(2017, 1, 2) + datetime.timedelta(weeks=i)
+            distribution = PointDistribution.objects.create(identifier=str(week), week=week, date=week,
+                                                            is_final=True, instance_id="1234")
+            GivenPoint.objects.create(from_member=member, to_member=member, points=100,
+                                      point_distribution=distribution, week=week, instance_id="1234")
+
+    def test_gzip(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content) / 4)
+
+    def test_brotli_preferred(self):
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(middleware.brotli.decompress(response.content), plain.content)
+
+    def test_not_compressed(self):
+        self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING='identity').has_header('Content-Encoding'))
+        self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+        with self.settings(COMPRESSION_MIN_SIZE=10 ** 6):
+            self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+
+    def test_streaming(self):
+        chunks = [json.dumps({'week': i}).encode() for i in range(100)]
+        request = APIRequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = middleware.CompressionMiddleware(lambda request: StreamingHttpResponse(iter(chunks)))(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        Member.objects.create(name="Name1", email="name1@email.com", instance_id="1234",
+                              identifier="82e37e019472168a59a6d959936e6aa7")
+
+    def get_sample(self, name, view):
+        labels = {'view': view, 'method': 'GET', 'status': '200'}
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_queries_recorded_per_view(self):
+        requests_before = self.get_sample('pointdistribution_request_duration_seconds_count', 'GivenPointsTeamTotal')
+        queries_before = self.get_sample('pointdistribution_request_db_queries_sum', 'GivenPointsTeamTotal')
+        self.client.get('/v1/team/points/?instance_id=1234')
+        self.assertEqual(self.get_sample('pointdistribution_request_duration_seconds_count', 'GivenPointsTeamTotal'),
+                         requests_before + 1)
+        self.assertGreater(self.get_sample('pointdistribution_request_db_queries_sum', 'GivenPointsTeamTotal'),
+                           queries_before)
+
+    def test_outbound_calls_recorded(self):
+        metrics.start_request()
+        with mock.patch('core.outbound.get_session') as get_session:
+            get_session.return_value.request.return_value.status_code = 200
+            outbound.request(outbound.VSTS, 'get', 'https://example.com')
+            outbound.gather([(outbound.VSTS, 'get', 'https://example.com', {})] * 3)
+        self.assertEqual(metrics._local.stats.outbound, 4)
+        metrics._local.stats = None
+
+    def test_metrics_endpoint(self):
+        self.client.get('/v1/team/points/?instance_id=1234')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('pointdistribution_request_duration_seconds_bucket{', content)
+        self.assertIn('view="GivenPointsTeamTotal"', content)
+        self.assertNotIn('instance_id', content)
+
+
+@override_settings(OUTBOUND_BREAKER_FAILURES=2, OUTBOUND_BREAKER_RESET_SECONDS=60)
+class OutboundClientTest(TestCase):
+    def setUp(self):
+        outbound._breakers.clear()
+        patcher = mock.patch('core.outbound.get_session')
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.addCleanup(outbound._breakers.clear)
+
+    def test_timeouts_of_the_dependency(self):
+        self.session.request.return_value.status_code = 200
+        outbound.request(outbound.SLACKBOT, 'post', 'https://example.com')
+        config = settings.OUTBOUND_DEPENDENCIES[outbound.SLACKBOT]
+        self.assertEqual(self.session.request.call_args[1]['timeout'],
+                         (config['connect_timeout'], config['read_timeout']))
+
+    def test_breaker_opens_and_fails_fast(self):
+        self.session.request.side_effect = requests.Timeout()
+        for _ in range(2):
+            with self.assertRaises(DependencyUnavailableException):
+                outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        with self.assertRaises(DependencyUnavailableException):
+            outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        self.assertEqual(self.session.request.call_count, 2)
+        # Other dependencies are not affected
+        self.session.request.side_effect = None
+        self.session.request.return_value.status_code = 202
+        self.assertEqual(outbound.request(outbound.SLACKBOT, 'post', 'https://example.com').status_code, 202)
+
+    def test_breaker_closes_after_successful_trial(self):
+        self.session.request.return_value.status_code = 503
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        breaker = outbound.get_breaker(outbound.VSTS)
+        self.assertFalse(breaker.allow())
+        breaker.opened_at -= 60
+        self.session.request.return_value.status_code = 200
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        self.assertIsNone(breaker.opened_at)
+
+    def test_unexpected_error_ends_the_trial(self):
+        self.session.request.return_value.status_code = 503
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        breaker = outbound.get_breaker(outbound.VSTS)
+        breaker.opened_at -= 60
+        self.session.request.side_effect = ValueError()
+        with self.assertRaises(ValueError):
+            outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        self.assertFalse(breaker.trial)
+        # The breaker opened again and lets the next trial through once the reset time is over
+        breaker.opened_at -= 60
+        self.session.request.side_effect = None
+        self.session.request.return_value.status_code = 200
+        outbound.request(outbound.VSTS, 'get', 'https://example.com')
+        self.assertIsNone(breaker.opened_at)
+
+    def test_slackbot_outage_does_not_fail_submission(self):
+        self.session.request.side_effect = requests.ConnectionError()
+        Member.objects.create(name="Name1", email="name1@email.com", instance_id="1234",
+                              identifier="82e37e019472168a59a6d959936e6aa7")
+        distr = {
+            'given_points': [
+                {'from_member': 'name1@email.com', 'to_member': 'name1@email.com', 'points': 100,
+                 'instance_id': "1234"}
+            ],
+            'date': date.today().isoformat(),
+            'instance_id': "1234"
+        }
+        request = APIRequestFactory().post('/v1/points/distribution/send/', distr, format='json')
+        with mock.patch('core.outbound.send_in_background', send_in_background):
+            self.assertEqual(SendPoints.as_view()(request).status_code, 200)
+        outbound.drain()
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_drain_waits_for_background_calls(self):
+        self.session.request.side_effect = lambda *args, **kwargs: time.sleep(0.2) or mock.Mock(status_code=202)
+        responses = []
+        for _ in range(3):
+            send_in_background(outbound.SLACKBOT, 'post', 'https://example.com', callback=responses.append)
+        with mock.patch('core.outbound.drain', wraps=outbound.drain) as drain:
+            gunicorn_conf.worker_exit(None, None)
+        self.assertEqual(drain.call_count, 1)
+        self.assertEqual([response.status_code for response in responses], [202] * 3)
+
+
+class LoggingTest(TestCase):
+    def make_record(self, level, msg, *args):
+        return logging.LogRecord('core.views', level, __file__, 1, msg, args, None)
+
+    def test_json_lines(self):
+        handler = BackgroundHandler()
+        handler.setFormatter(JSONFormatter())
+        handler.target.stream = StringIO()
+        data = {'points': 100}
+        handler.handle(self.make_record(logging.INFO, 'Received %s', data))
+        data['points'] = 0
+        handler.close()
+        entry = json.loads(handler.target.stream.getvalue())
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['message'], "Received {'points': 100}")
+
+    def test_full_queue_drops_records(self):
+        handler = BackgroundHandler(maxsize=1)
+        handler.start()
+        handler.listener.stop()
+        handler.handle(self.make_record(logging.INFO, 'first'))
+        handler.handle(self.make_record(logging.INFO, 'second'))
+        self.assertEqual(handler.dropped, 1)
+
+    def test_sampling_keeps_warnings(self):
+        sampling = SamplingFilter(rate=0)
+        self.assertFalse(sampling.filter(self.make_record(logging.INFO, 'info')))
+        self.assertTrue(sampling.filter(self.make_record(logging.WARNING, 'warning')))
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        overrides = override_settings(PROFILING_ENABLED=True, PROFILING_DIR=directory, PROFILING_MAX_FILES=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        Member.objects.create(name="Name1", email="name1@email.com", instance_id="1234",
+                              identifier="82e37e019472168a59a6d959936e6aa7")
+
+    def test_only_requests_with_valid_token_are_profiled(self):
+        self.client.get('/v1/team/points/?instance_id=1234')
+        self.client.get('/v1/team/points/?instance_id=1234', HTTP_X_PROFILE_TOKEN='profile:forged')
+        self.assertEqual(profiling.list_profiles(10, 5), [])
+
+        self.client.get('/v1/team/points/?instance_id=1234', HTTP_X_PROFILE_TOKEN=profiling.make_token())
+        profile, = profiling.list_profiles(10, 5)
+        self.assertEqual(profile['view'], 'GivenPointsTeamTotal')
+        self.assertEqual(profile['tenant'], '1234')
+        self.assertGreater(profile['queries'], 0)
+        self.assertEqual(len(profile['top_functions']), 5)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_ring_keeps_latest_profiles(self):
+        for _ in range(3):
+            self.client.get('/v1/team/points/?instance_id=1234')
+        self.assertEqual(len(profiling.list_profiles(10, 1)), 2)
+        self.assertEqual(len(os.listdir(settings.PROFILING_DIR)), 4)
+
+    def test_profiles_endpoint_staff_only(self):
+        self.client.get('/v1/team/points/?instance_id=1234', HTTP_X_PROFILE_TOKEN=profiling.make_token())
+        self.assertEqual(self.client.get('/profiles/').status_code, 403)
+        User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        response = self.client.get('/profiles/?top=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()[0]['top_functions']), 3)
+
+    def test_profiles_endpoint_invalid_parameters(self):
+        User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        for query in ('limit=abc', 'top=1.5', 'limit=-1', 'top=-3'):
+            self.assertEqual(self.client.get('/profiles/?' + query).status_code, 400)
+
+
+class LifecycleBenchmarkTest(TestCase):
+    def test_valid_point_values(self):
+        for members_count in (1, 2, 10, 14):
+            values = get_valid_point_values(members_count)
+            self.assertEqual(sum(values), 100)
+            self.assertEqual(len(set(values)), members_count)
+        with self.assertRaises(ValueError):
+            get_valid_point_values(15)
+
+    def test_lifecycle_report(self):
+        out = StringIO()
+        call_command('benchmark_lifecycle', teams=2, members=3, reads=1, stdout=out)
+        results = json.loads(out.getvalue())
+        endpoints = results['endpoints']
+        self.assertEqual(endpoints['SendPoints POST']['requests'], 6)
+        self.assertEqual(endpoints['ValidateProvisionalPointDistribution PUT']['requests'], 2)
+        self.assertEqual(endpoints['MemberPointsHistory GET']['requests'], 6)
+        self.assertGreater(endpoints['MemberList GET']['queries_per_request'], 0)
+        self.assertEqual(results['requests'], sum(endpoint['requests'] for endpoint in endpoints.values()))
+        self.assertFalse(Member.objects.exists())
+
+
+class GenerateDatasetTest(TestCase):
+    def test_valid_distributions(self):
+        call_command('generate_dataset', tenants=2, team_sizes='3', weeks=2, seed=1, stdout=StringIO())
+        self.assertEqual(Team.objects.count(), 2)
+        self.assertEqual(Member.objects.count(), 6)
+        self.assertEqual(GivenPointArchived.objects.count(), 2 * 2 * 3 * 3)
+        member = Member.objects.get(email='member0@synthetic-1.com')
+        self.assertEqual(member.identifier, concatenate_and_hash(member.email, 'synthetic-1'))
+        for distribution in PointDistribution.objects.filter(is_final=True):
+            points = [given_point.points for given_point in distribution.given_points.all()]
+            self.assertEqual(sum(points), 100)
+            self.assertEqual(len(set(points)), 3)
+        self.assertEqual(PointDistribution.objects.filter(is_final=False).count(), 2)
+
+    def test_team_sizes_need_valid_distribution(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', tenants=1, team_sizes='10-15', stdout=StringIO())
+
+    def test_same_seed_same_data(self):
+        def generate():
+            call_command('generate_dataset', tenants=4, team_sizes='3-6', weeks=3, seed=7, stdout=StringIO())
+            return [
+                list(Member.objects.order_by('instance_id', 'email').values_list('instance_id', 'email')),
+                list(GivenPoint.objects.order_by('instance_id', 'week', 'from_member__email', 'to_member__email')
+                     .values_list('instance_id', 'week', 'from_member__email', 'to_member__email', 'points')),
+                list(GivenPointArchived.objects.order_by('instance_id', 'week', 'from_member__email',
+                                                         'to_member__email')
+                     .values_list('instance_id', 'week', 'from_member__email', 'to_member__email', 'points')),
+            ]
+
+        data = generate()
+        truncate_all()
+        self.assertEqual(generate(), data)
+
+
+class PurgeTest(TestCase):
+    def setUp(self):
+        call_command('generate_dataset', tenants=2, team_sizes='3', weeks=2, seed=1, stdout=StringIO())
+        IdempotencyKey.objects.create(instance_id='synthetic-0', key='key', fingerprint='fingerprint')
+        User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+
+    def count_rows(self, instance_id):
+        return sum(model.objects.filter(instance_id=instance_id).count()
+                   for model in (GivenPoint, GivenPointArchived, PointDistribution, Member, Team, IdempotencyKey))
+
+    def test_purge_team(self):
+        version = get_tenant_data_version('synthetic-0')
+        rows = self.count_rows('synthetic-1')
+        response = self.client.delete('/v1/teams/purge/?instance_id=synthetic-0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['deleted']['Member'], 3)
+        self.assertEqual(response.json()['deleted']['IdempotencyKey'], 1)
+        self.assertEqual(self.count_rows('synthetic-0'), 0)
+        self.assertEqual(self.count_rows('synthetic-1'), rows)
+        # The ETags of the purged data never match again
+        self.assertGreater(get_tenant_data_version('synthetic-0'), version)
+
+    def test_purge_command(self):
+        call_command('purge_tenant', 'synthetic-0', 'synthetic-1', stdout=StringIO())
+        self.assertEqual(self.count_rows('synthetic-0') + self.count_rows('synthetic-1'), 0)
+        with self.assertRaises(CommandError):
+            call_command('purge_tenant', stdout=StringIO())
+
+    @override_settings(PURGE_TRUNCATE_ENABLED=True)
+    def test_truncate(self):
+        self.assertEqual(self.client.delete('/v1/members/reset/').status_code, 204)
+        self.assertEqual(self.count_rows('synthetic-0') + self.count_rows('synthetic-1'), 0)
+
+    @override_settings(PURGE_TRUNCATE_ENABLED=False)
+    def test_truncate_disabled(self):
+        self.assertEqual(self.client.delete('/v1/teams/purge/').status_code, 403)
+        self.assertEqual(Team.objects.count(), 2)
+
+    @override_settings(PURGE_TRUNCATE_ENABLED=True)
+    def test_purge_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.delete('/v1/teams/purge/?instance_id=synthetic-0').status_code, 403)
+        self.assertEqual(self.client.delete('/v1/members/reset/').status_code, 403)
+        User.objects.create_user('user', password='password')
+        self.client.login(username='user', password='password')
+        self.assertEqual(self.client.delete('/v1/teams/purge/').status_code, 403)
+        self.assertEqual(Team.objects.count(), 2)
+
+
+class CompactArchivedPointsTest(TestCase):
+    def setUp(self):
+        call_command('generate_dataset', tenants=2, team_sizes='3', weeks=6, seed=1, stdout=StringIO())
+        self.factory = APIRequestFactory()
+
+    def get_total(self):
+        request = self.factory.get('/v1/team/points/?instance_id=synthetic-0')
+        return GivenPointsTeamTotal.as_view()(request).data
+
+    def get_history(self):
+        request = self.factory.get('/v1/member/history/member0@synthetic-0.com/?instance_id=synthetic-0')
+        return MemberPointsHistory.as_view()(request, email='member0@synthetic-0.com').data
+
+    def test_compact(self):
+        total = self.get_total()
+        received = sum(given_point['points'] for given_point in self.get_history())
+        call_command('compact_archived_points', retain_weeks=2, batch_size=1, stdout=StringIO())
+
+        horizon = date.today() - datetime.timedelta(days=date.today().weekday(), weeks=2)
+        self.assertFalse(GivenPointArchived.objects.filter(week__lt=horizon).exists())
+        self.assertEqual(GivenPointArchived.objects.count(), 2 * 2 * 3 * 3)
+        self.assertEqual(GivenPointArchivedSummary.objects.count(), 2 * 4 * 3)
+        self.assertEqual(set(GivenPointArchivedSummary.objects.values_list('givers', flat=True)), {3})
+        # Both tiers are read
+        self.assertEqual(self.get_total(), total)
+        history = self.get_history()
+        self.assertEqual([given_point['from_member'] for given_point in history[:4]], [None] * 4)
+        self.assertEqual(len(history), 4 + 2 * 3)
+        self.assertEqual(sum(given_point['points'] for given_point in history), received)
+
+    def test_points_archived_after_compaction(self):
+        call_command('compact_archived_points', retain_weeks=2, stdout=StringIO())
+        summary = GivenPointArchivedSummary.objects.filter(instance_id='synthetic-0').first()
+        GivenPointArchived.objects.create(to_member=summary.to_member, points=10, week=summary.week,
+                                          instance_id='synthetic-0')
+        call_command('compact_archived_points', retain_weeks=2, stdout=StringIO())
+        updated = GivenPointArchivedSummary.objects.get(pk=summary.pk)
+        self.assertEqual((updated.points, updated.givers), (summary.points + 10, summary.givers + 1))
+        self.assertEqual(GivenPointArchivedSummary.objects.count(), 2 * 4 * 3)
+
+    def test_points_archived_during_compaction(self):
+        total = self.get_total()
+        horizon = date.today() - datetime.timedelta(days=date.today().weekday(), weeks=2)
+        archived = GivenPointArchived.objects.filter(instance_id='synthetic-0', week__lt=horizon).first()
+        bulk_create = QuerySet.bulk_create
+        late = []
+
+        def archive_meanwhile(queryset, objs, *args, **kwargs):
+            # A validation archives points of the batch after they were summed
+            if queryset.model is GivenPointArchivedSummary and not late:
+                late.append(GivenPointArchived.objects.create(to_member=archived.to_member, points=10,
+                                                              week=archived.week, instance_id='synthetic-0'))
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=archive_meanwhile):
+            call_command('compact_archived_points', retain_weeks=2, stdout=StringIO())
+        self.assertTrue(GivenPointArchived.objects.filter(pk=late[0].pk).exists())
+        self.assertEqual(self.get_total()[archived.to_member.name], total[archived.to_member.name] + 10)
+        # The next run compacts them
+        call_command('compact_archived_points', retain_weeks=2, stdout=StringIO())
+        self.assertFalse(GivenPointArchived.objects.filter(week__lt=horizon).exists())
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Run every endpoint against teams of 14 members with weeks of history, each request has to stay within the
+    query_budget of its view
+    """
+    # Function views without queries
+    UNBUDGETED = ('prometheus_metrics',)
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_dataset', tenants=3, team_sizes='14', weeks=20, seed=1, stdout=StringIO())
+        # Half of the history is compacted, the reads go through both tiers
+        call_command('compact_archived_points', retain_weeks=10, stdout=StringIO())
+        with batched_version_bumps():
+            GivenPoint.objects.filter(point_distribution__is_final=False).delete()
+
+    def setUp(self):
+        self.instance_id = 'synthetic-1'
+        self.emails = ['member%s@synthetic-1.com' % i for i in range(14)]
+        self.week = get_monday_from_date(date.today().isoformat(), '%Y-%m-%d')
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            if data is None:
+                response = getattr(self.client, method)(path)
+            else:
+                response = getattr(self.client, method)(path, json.dumps(data), content_type='application/json')
+        self.assertLess(response.status_code, 400, response.content)
+        budget = metrics.get_query_budget(response.wsgi_request)
+        self.assertIsNotNone(budget)
+        queries = context.captured_queries
+        if len(queries) > budget:
+            self.fail('%s %s ran %s queries, its budget is %s:\n%s' % (
+                method.upper(), path, len(queries), budget,
+                '\n'.join('%s. %s' % (idx, query['sql']) for idx, query in enumerate(queries, 1))))
+        return response
+
+    def test_every_endpoint_has_a_budget(self):
+        from core.urls import urlpatterns
+        from pointdistribution.urls import urlpatterns as root_urlpatterns
+        for pattern in list(urlpatterns) + list(root_urlpatterns):
+            # Included url patterns have no callback
+            if getattr(pattern, 'callback', None) is None or pattern.callback.__name__ in self.UNBUDGETED:
+                continue
+            view_class = pattern.callback.view_class
+            for method in view_class.http_method_names:
+                if method not in ('head', 'options') and hasattr(view_class, method):
+                    self.assertIn(method, view_class.query_budget, '%s has no budget for %s' % (
+                        view_class.__name__, method))
+
+    def test_reads(self):
+        self.request('get', '/v1/teams/all/')
+        self.request('get', '/v1/teams/team/?instance_id=%s' % self.instance_id)
+        self.request('get', '/v1/team/points/?instance_id=%s' % self.instance_id)
+        self.request('get', '/v1/team/points/?instance_id=%s&from_week=2017-01-02' % self.instance_id)
+        self.request('get', '/v1/points/distribution/history/?instance_id=%s' % self.instance_id)
+        self.request('get', '/v1/points/distribution/%s/?instance_id=%s' % (self.week, self.instance_id))
+        self.request('get', '/v1/member/history/%s/?instance_id=%s' % (self.emails[0], self.instance_id))
+        User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        self.request('get', '/profiles/')
+
+    def test_member_import(self):
+        adapter = StandInAdapter(14, 0)
+        for dependency in settings.OUTBOUND_DEPENDENCIES:
+            outbound.get_session(dependency).mount('https://', adapter)
+            outbound.get_session(dependency).mount('http://', adapter)
+        self.addCleanup(outbound._sessions.clear)
+        # Existing members, then a new team
+        for instance_id in (self.instance_id, 'new-team'):
+            response = self.request('get', '/v1/members/?instance_id=%s&instance_name=%s&user_email=%s' % (
+                instance_id, instance_id, 'member0@%s.com' % instance_id))
+            self.assertEqual(len(response.json()), 14)
+        self.request('post', '/v1/members/', {
+            'email': 'member14@new-team.com', 'name': 'Member 14', 'instance_id': 'new-team'})
+
+    def test_weekly_lifecycle(self):
+        values = get_valid_point_values(14)
+
+        def given_points(from_member, values):
+            return {
+                'given_points': [{'from_member': from_member, 'to_member': to_member, 'points': points,
+                                  'instance_id': self.instance_id} for to_member, points in zip(self.emails, values)],
+                'date': date.today().isoformat(),
+                'instance_id': self.instance_id,
+            }
+
+        for email in self.emails:
+            self.request('post', '/v1/points/distribution/send/', given_points(email, values))
+        for email in self.emails:
+            self.request('put', '/v1/points/distribution/send/', given_points(email, values[::-1]))
+        # The other teams send all their points at once
+        distributions = []
+        for instance_id in ('synthetic-0', 'synthetic-2'):
+            emails = ['member%s@%s.com' % (i, instance_id) for i in range(14)]
+            distributions.extend({
+                'given_points': [{'from_member': email, 'to_member': to_member, 'points': points,
+                                  'instance_id': instance_id} for to_member, points in zip(emails, values)],
+                'date': date.today().isoformat(),
+                'instance_id': instance_id,
+            } for email in emails)
+        response = self.request('post', '/v1/points/distribution/send/batch/', {'distributions': distributions})
+        self.assertEqual(set(result['status'] for result in response.json()['results']), {200})
+        response = self.request('put', '/v1/points/distribution/validate/', {
+            'week': self.week, 'instance_id': self.instance_id})
+        self.assertTrue(response.json()['is_final'])
+        self.assertEqual(GivenPointArchived.objects.filter(instance_id=self.instance_id, week=self.week).count(),
+                         14 * 14)
+
+    def test_purge(self):
+        User.objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        response = self.request('delete', '/v1/teams/purge/?instance_id=%s' % self.instance_id)
+        self.assertEqual(response.json()['deleted']['Member'], 14)
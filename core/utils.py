@@ -1,11 +1,28 @@
 import datetime
 import hashlib
-from .models import Member, PointDistribution, GivenPoint
-
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from .models import Member, PointDistribution, GivenPoint, TenantDataVersion, TenantShard
+from .exceptions import InvalidWeekException
+from .routers import choose_replica, get_tenant_database
+
+from django.conf import settings
 from django.http import Http404
+from django.db import transaction, IntegrityError, OperationalError, router, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.db.models import F
 
 DATE_PATTERN = '%Y-%m-%d'
 WEEK_PATTERN = '%Y-%W'
+# Given points are serialized with the member hashes, fetch the members along with them
+GIVEN_POINTS_PREFETCH = ('given_points__from_member', 'given_points__to_member')
+# SQLSTATE of the PostgreSQL serialization failures and deadlocks, the transaction can simply be run again
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+
+_changes = threading.local()
 
 
 def is_current_week(date, pattern):
@@ -20,6 +37,23 @@ def get_monday_from_date(date, pattern):
     return monday.strftime(pattern)
 
 
+def get_week_range(request):
+    """
+    Lookups for the optional from_week/to_week bounds of a request, they let postgres prune the archive partitions
+    """
+    lookups = {}
+    for param, lookup in (('from_week', 'week__gte'), ('to_week', 'week__lte')):
+        value = request.GET.get(param, '')
+        if value == '':
+            continue
+        try:
+            datetime.datetime.strptime(value, DATE_PATTERN)
+        except ValueError:
+            raise InvalidWeekException()
+        lookups[lookup] = value
+    return lookups
+
+
 def get_member(email, instance_id):
     try:
         return Member.objects.get(email=email, instance_id=instance_id)
@@ -35,29 +69,33 @@ def get_all_members(instance_id):
 
 
 def get_given_point_models(given_points, week, instance_id):
-    models = []
+    """
+    The given points of a week matching the from_member and to_member emails of a request, in the same order
+    """
+    keys = [(concatenate_and_hash(given_point['from_member'], instance_id),
+             concatenate_and_hash(given_point['to_member'], instance_id)) for given_point in given_points]
+    queryset = GivenPoint.objects.filter(week=week, instance_id=instance_id,
+                                         from_member__identifier__in=set(key[0] for key in keys))\
+        .select_related('from_member', 'to_member')
+    models = dict(((model.from_member.identifier, model.to_member.identifier), model) for model in queryset)
     try:
-        for given_point in given_points:
-            from_member = concatenate_and_hash(given_point['from_member'], instance_id)
-            to_member = concatenate_and_hash(given_point['to_member'], instance_id)
-            model = GivenPoint.objects.get(from_member=from_member, to_member=to_member, week=week)
-            models.append(model)
-    except Member.DoesNotExist:
+        return [models[key] for key in keys]
+    except KeyError:
         raise Http404
 
-    return models
-
 
-def get_points_distributions(week):
+def get_points_distributions(week, instance_id):
     try:
-        return PointDistribution.objects.get(week=week)
+        return PointDistribution.objects.prefetch_related(*GIVEN_POINTS_PREFETCH)\
+            .get(week=week, instance_id=instance_id)
     except PointDistribution.DoesNotExist:
         raise Http404
 
 
 def filter_final_points_distributions(instance_id, is_final=True):
     try:
-        return PointDistribution.objects.filter(instance_id=instance_id, is_final=is_final)
+        return PointDistribution.objects.filter(instance_id=instance_id, is_final=is_final)\
+            .prefetch_related(*GIVEN_POINTS_PREFETCH)
     except PointDistribution.DoesNotExist:
         raise Http404
 
@@ -66,3 +104,133 @@ def concatenate_and_hash(field1, field2):
     concat_str = '%s%s' % (field1, field2)
     hashed_obj = hashlib.md5(concat_str.encode('utf-8'))
     return hashed_obj.hexdigest()
+
+
+def get_tenant_data_version(instance_id, using=None):
+    # Read from the database the body is read from, by default, so that an ETag never names data the body lacks
+    versions = TenantDataVersion.objects.using(using or router.db_for_read(TenantDataVersion))
+    version = versions.filter(instance_id=instance_id).values_list('version', flat=True).first()
+    return version if version is not None else 0
+
+
+def bump_tenant_data_version(instance_id, using=None):
+    versions = TenantDataVersion.objects.using(using)
+    if versions.filter(instance_id=instance_id).update(version=F('version') + 1, modified=timezone.now()):
+        return
+    try:
+        with transaction.atomic(using=versions.db):
+            versions.create(instance_id=instance_id, version=1)
+    except IntegrityError:
+        # Another request created the row in the meantime
+        versions.filter(instance_id=instance_id).update(version=F('version') + 1, modified=timezone.now())
+
+
+def record_tenant_change(instance_id, using=None):
+    """
+    Bump the data version of a tenant, inside batched_version_bumps() the bump is only noted
+    """
+    pending = getattr(_changes, 'pending', None)
+    if pending is None:
+        bump_tenant_data_version(instance_id, using)
+    else:
+        # The signals name the database, the other callers leave it to the router
+        pending.add((instance_id, using or router.db_for_write(TenantDataVersion)))
+
+
+@contextmanager
+def batched_version_bumps():
+    """
+    Bump the data version of every tenant changed in the block once when it ends, instead of once per row saved or
+    deleted
+    """
+    if getattr(_changes, 'pending', None) is not None:
+        # The outer block bumps them
+        yield
+        return
+    _changes.pending = set()
+    try:
+        yield
+        pending = _changes.pending
+    finally:
+        _changes.pending = None
+    for instance_id, using in pending:
+        bump_tenant_data_version(instance_id, using)
+
+
+def get_members_by_email(instance_id):
+    return dict((member.email, member) for member in Member.objects.filter(instance_id=instance_id))
+
+
+def get_replica_database(instance_id):
+    """
+    Replica to serve the reads of a tenant from, None keeps them on the primary. A tenant that wrote recently stays
+    on the primary so that it always reads its own writes, as does a tenant whose data version the replica does not
+    have yet.
+    """
+    primary = router.db_for_write(TenantDataVersion)
+    if not settings.DATABASE_REPLICAS.get(primary):
+        return None
+    version, modified = TenantDataVersion.objects.using(primary).filter(instance_id=instance_id)\
+        .values_list('version', 'modified').first() or (0, None)
+    if modified is not None and timezone.now() - modified < datetime.timedelta(seconds=settings.REPLICA_STICKY_SECONDS):
+        return None
+    replica = choose_replica(primary)
+    if replica is None or get_tenant_data_version(instance_id, replica) != version:
+        return None
+    return replica
+
+
+def tenant_etag(request, *args, **kwargs):
+    """
+    ETag of a tenant scoped GET endpoint, computed from the tenant data version only so that a matching
+    If-None-Match is answered before any queryset or serializer is built. The JSON and MessagePack bodies of a URL
+    get different ETags.
+    """
+    instance_id = request.GET.get('instance_id', '')
+    if instance_id == '':
+        return None
+    media_type = getattr(request, 'accepted_media_type', None) or request.META.get('HTTP_ACCEPT', '')
+    return concatenate_and_hash(request.get_full_path() + ' ' + media_type, get_tenant_data_version(instance_id))
+
+
+def get_tenant_shard(instance_id, create=False):
+    """
+    Shard map entry of a tenant, new tenants are placed on a shard picked from the hash of their instance_id. The
+    placement is only saved with create, by the callers about to write, so reads of unknown tenants leave no entry.
+    Without shards everything stays on the default database and there is no entry.
+    """
+    shards = settings.TENANT_SHARDS
+    if len(shards) == 1:
+        return None
+    placement = shards[int(concatenate_and_hash(instance_id, ''), 16) % len(shards)]
+    if create:
+        shard, _ = TenantShard.objects.using('default').get_or_create(instance_id=instance_id,
+                                                                      defaults={'database': placement})
+        return shard
+    shard = TenantShard.objects.using('default').filter(instance_id=instance_id).first()
+    return shard if shard is not None else TenantShard(instance_id=instance_id, database=placement)
+
+
+def is_retryable(error):
+    cause = error.__cause__
+    if getattr(cause, 'pgcode', None) in RETRYABLE_SQLSTATES:
+        return True
+    return 'database is locked' in str(error)
+
+
+def run_in_transaction(func, *args, attempts=3, backoff=0.05, **kwargs):
+    """
+    Run func in a transaction, running it again a bounded number of times after a serialization failure or a deadlock.
+    The jittered backoff keeps the retries of concurrent requests from colliding again.
+    """
+    using = get_tenant_database() or DEFAULT_DB_ALIAS
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            # Inside an outer transaction the failure belongs to the caller
+            if attempt == attempts or not is_retryable(e) or transaction.get_connection(using).in_atomic_block:
+                raise
+            logging.warning("Retrying transaction after %s (attempt %s/%s)", e, attempt, attempts)
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
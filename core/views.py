@@ -1,61 +1,136 @@
-from .models import Member, GivenPoint, GivenPointArchived, PointDistribution, Team
-from .serializers import MemberSerializer, GivenPointArchivedSerializer, PointDistributionSerializer, \
-    GivenPointSerializer, TeamSerializer
+from .models import Member, GivenPoint, GivenPointArchived, GivenPointArchivedSummary, PointDistribution, Team
+from .serializers import MemberSerializer, PointDistributionSerializer, GivenPointSerializer, \
+    MemberValuesSerializer, GivenPointArchivedValuesSerializer, PointDistributionValuesSerializer, \
+    GivenPointArchivedSummaryValuesSerializer
 from .points_operation import validate_provisional_point_distribution, check_batch_includes_all_members, \
     check_all_point_values_are_valid
 from .utils import is_current_week, get_member, filter_final_points_distributions, get_all_members, \
-    get_given_point_models, get_monday_from_date, DATE_PATTERN, concatenate_and_hash
-from .exceptions import NotCurrentWeekException
-
-from django.http import Http404
+    get_given_point_models, get_monday_from_date, DATE_PATTERN, concatenate_and_hash, tenant_etag, \
+    get_week_range, get_tenant_shard, get_replica_database, run_in_transaction, get_members_by_email, \
+    record_tenant_change, batched_version_bumps
+from .exceptions import NotCurrentWeekException, TenantLockedException, FinalPointDistributionException, \
+    PointsAlreadySentException, InvalidBatchException, TruncateDisabledException, InvalidProfileQueryException
+from .routers import set_tenant_database, set_read_database, choose_replica, get_tenant_database
+from .idempotency import idempotent
+from . import outbound, metrics, profiling, purge
+
+from django.http import Http404, HttpResponse
+from django.conf import settings
+from django.db import transaction, router, DEFAULT_DB_ALIAS
 from django.db.utils import IntegrityError
-from django.db.models import Sum
+from django.db.models import Sum, Case, When, Value, IntegerField
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.exceptions import APIException
+
+from pointdistribution.settings import VSTS_BASE_URL, SETTING_MANAGE_BASE_URL, SLACKBOT_URL, TENANT_SHARDS
 
-from pointdistribution.settings import VSTS_BASE_URL, SETTING_MANAGE_BASE_URL, SLACKBOT_URL
+from collections import OrderedDict
 
-import requests
 import logging
 import json
 
+logger = logging.getLogger(__name__)
+
 
 def construct_url_for_project(instance_name):
     request_url = VSTS_BASE_URL.format(instance_name)
     return request_url
 
 
-class TeamList(APIView):
+class TenantShardMixin(object):
+    """
+    Run the queries of a request against the shard of the tenant given by its instance_id. Safe requests of the
+    views with replica_read read from a replica of that shard. Requests that write are refused while the tenant is
+    being moved, views writing on GET set writes_on_get.
+    """
+    replica_read = False
+    writes_on_get = False
+    # Most queries each method may run whatever the amount of data, enforced by QueryBudgetTest and logged when
+    # exceeded while debugging
+    query_budget = {}
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        instance_id = request.query_params.get('instance_id', '')
+        if instance_id == '' and hasattr(request.data, 'get'):
+            instance_id = request.data.get('instance_id', '')
+        if instance_id == '':
+            return
+        profiling.set_tenant(instance_id)
+        shard = get_tenant_shard(instance_id, create=self.writes(request))
+        if shard is not None:
+            if shard.is_locked and self.writes(request):
+                raise TenantLockedException()
+            set_tenant_database(shard.database)
+        if self.replica_read and request.method in SAFE_METHODS:
+            set_read_database(get_replica_database(instance_id))
+
+    def writes(self, request):
+        return request.method not in SAFE_METHODS or (request.method == 'GET' and self.writes_on_get)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            set_tenant_database(None)
+            set_read_database(None)
+
+
+def log_slackbot_response(slackbot_response):
+    if slackbot_response.status_code == 202:
+        logger.info("Successfully submitted to slack channel")
+    else:
+        logger.warning("Failed to submit messages to slack channel, status_code=%s",
+                       slackbot_response.status_code)
+
+
+def send_to_slackbot(data):
+    """
+    Notifications are sent in the background, the response does not wait for Slack
+    """
+    outbound.send_in_background(outbound.SLACKBOT, 'post', SLACKBOT_URL + 'v1/api/send/', data=data,
+                                callback=log_slackbot_response)
+
+
+class TeamList(TenantShardMixin, APIView):
     """
     Get all teams or a team with all its member
     Endpoint: **/v1/teams/all or **/v1/teams/team/?instance_id=2349
     """
+    replica_read = True
+    query_budget = {'get': 3}
+
+    @method_decorator(condition(etag_func=tenant_etag))
     def get(self, request):
         instance_id = request.GET.get('instance_id', '')
 
         if instance_id is None or instance_id == '':
-            # Return all teams
-            teams = Team.objects.all()
+            # Return all teams of every shard
             teams_list = dict()
 
-            for team in teams:
-                instance_id = team.instance_id
-                instance_name = team.instance_name
-                # Go fetch each team
-                # TODO: Need to optimize this in the future
-                members = Member.objects.all().filter(instance_id=instance_id)
-                members_serializer = MemberSerializer(members, many=True)
+            for database in TENANT_SHARDS:
+                set_tenant_database(database)
+                set_read_database(choose_replica(database))
 
-                if instance_id == '':
-                    continue
-                else:
-                    teams_list[instance_id] = {
-                        'instance_name': instance_name,
-                        'members': members_serializer.data
-                    }
+                # The members of all the teams of the shard in one query
+                members = dict()
+                for key, member in MemberValuesSerializer(Member.objects.all()).get_rows('instance_id'):
+                    members.setdefault(key[0], []).append(member)
+
+                for instance_id, instance_name in Team.objects.values_list('instance_id', 'instance_name'):
+                    if instance_id == '':
+                        continue
+                    else:
+                        teams_list[instance_id] = {
+                            'instance_name': instance_name,
+                            'members': members.get(instance_id, [])
+                        }
 
             return Response(data=json.dumps(teams_list), status=status.HTTP_200_OK)
         elif instance_id is not None and instance_id != '':
@@ -64,7 +139,7 @@ class TeamList(APIView):
                 team = Team.objects.get(instance_id=instance_id)
 
                 members = Member.objects.all().filter(instance_id=instance_id)
-                members_serializer = MemberSerializer(members, many=True)
+                members_serializer = MemberValuesSerializer(members, many=True)
 
                 team_list = dict()
                 team_list[instance_id] = {
@@ -75,13 +150,13 @@ class TeamList(APIView):
                 return Response(data=json.dumps(team_list), status=status.HTTP_200_OK)
 
             except Team.DoesNotExist as e:
-                logging.warn(e)
+                logger.warning(e)
                 return Response(data=e, status=status.HTTP_404_NOT_FOUND)
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class MemberList(APIView):
+class MemberList(TenantShardMixin, APIView):
     """
     Get all the members, create a member
 
@@ -89,72 +164,89 @@ class MemberList(APIView):
 
     Methods: *GET POST*
     """
+    query_budget = {'get': 15, 'post': 4}
+    # The import creates the team and its members
+    writes_on_get = True
+
+    @staticmethod
+    def create_members(members, instance_id):
+        try:
+            with transaction.atomic(using=router.db_for_write(Member)):
+                Member.objects.bulk_create(members)
+        except IntegrityError:
+            # A concurrent import created some of them, create the others one by one
+            for member in members:
+                try:
+                    with transaction.atomic(using=router.db_for_write(Member)):
+                        member.save()
+                except IntegrityError as e:
+                    logger.warning(e)
+            return
+        # bulk_create sends no post_save
+        record_tenant_change(instance_id)
+
     def get(self, request):
         instance_id = request.GET.get('instance_id', '')
         vsts_instance = request.GET.get('instance_name', '')
         user_email = request.GET.get('user_email', '')
 
         # Creating team
-        try:
-            logging.info("Creating team instance_id={} instance_name={}".format(instance_id, vsts_instance))
-            Team.objects.create(instance_id=instance_id, instance_name=vsts_instance)
-
-        except IntegrityError as e:
-            logging.warn(e)
+        logger.info("Creating team instance_id=%s instance_name=%s", instance_id, vsts_instance)
+        Team.objects.get_or_create(instance_id=instance_id, defaults={'instance_name': vsts_instance})
 
-        logging.info("Received {} {} {}".format(instance_id, vsts_instance, user_email))
+        logger.info("Received %s %s %s", instance_id, vsts_instance, user_email)
 
         params = {'instance_id': instance_id, 'user_email': user_email}
-        vsts_token_request = requests.get(SETTING_MANAGE_BASE_URL + "v1/tokenstorage", params=params)
+        vsts_token_request = outbound.request(outbound.TOKENSTORAGE, 'get', SETTING_MANAGE_BASE_URL + "v1/tokenstorage",
+                                              params=params)
         vsts_token = vsts_token_request.json()['vsts_token']
         email_account_name = user_email.split('@')
+        auth = (email_account_name, vsts_token)
 
         vsts_request_url = construct_url_for_project(vsts_instance)
 
-        r = requests.get(vsts_request_url, auth=(email_account_name, vsts_token))
+        r = outbound.request(outbound.VSTS, 'get', vsts_request_url, auth=auth)
 
         projects = r.json()['value']
-
-        for project in projects:
-            # Get all team members
-            project_id = project['id']
-            r = requests.get('https://{}.visualstudio.com/DefaultCollection/_apis/projects/{}/teams'.format(vsts_instance,
-                                                                                                      project_id),
-                             auth=(email_account_name, vsts_token))
-            team_id = r.json()['value'][0]['id']
-
-            team_member_data = requests.get('https://{}.visualstudio.com/DefaultCollection/_apis/projects/{}/teams/{}/'
-                                            'members?api_version=1.0'.format(vsts_instance, project_id, team_id),
-                                            auth=(email_account_name, vsts_token))
+        project_ids = [project['id'] for project in projects]
+
+        # The projects are independent of each other, fetch their teams and then members concurrently
+        teams_responses = outbound.gather([
+            (outbound.VSTS, 'get', 'https://{}.visualstudio.com/DefaultCollection/_apis/projects/{}/teams'.format(
+                vsts_instance, project_id), {'auth': auth})
+            for project_id in project_ids
+        ])
+        team_ids = [r.json()['value'][0]['id'] for r in teams_responses]
+
+        members_responses = outbound.gather([
+            (outbound.VSTS, 'get', 'https://{}.visualstudio.com/DefaultCollection/_apis/projects/{}/teams/{}/'
+                                   'members?api_version=1.0'.format(vsts_instance, project_id, team_id), {'auth': auth})
+            for project_id, team_id in zip(project_ids, team_ids)
+        ])
+
+        existing_emails = set(Member.objects.filter(instance_id=instance_id).values_list('email', flat=True))
+        new_members = OrderedDict()
+        for team_member_data in members_responses:
             team_members = team_member_data.json()['value']
 
             for team_member in team_members:
                 email = team_member['uniqueName']
                 name = team_member['displayName']
+                if email in existing_emails or email in new_members:
+                    continue
                 identifier = concatenate_and_hash(email, instance_id)
 
-                logging.debug('email={} name={} identifier={}'.format(email, name, identifier))
+                logger.debug('email=%s name=%s identifier=%s', email, name, identifier)
+                new_members[email] = Member(email=email, name=name, instance_id=instance_id, identifier=identifier)
 
-                try:
-                    logging.info("Create member entry")
-                    Member.objects.create(email=email, name=name, instance_id=instance_id, identifier=identifier)
-
-                except Member.DoesNotExist:
-                    logging.info("Could not find member, creating new member with the following information;"
-                                 "name={}, email{}, instance_id={}, identifier={}".format(name, email,
-                                                                                          instance_id, identifier))
-                    Member.objects.create(email=email, name=name, instance_id=instance_id, identifier=identifier)
-
-                except IntegrityError as e:
-                    logging.warn(e)
-
-                except Exception as e:
-                    logging.error("Something unexpected happened during the member filter", e)
+        if new_members:
+            logger.info("Creating %s members", len(new_members))
+            self.create_members(list(new_members.values()), instance_id)
 
         # Now fetch all the members and return them
         members = Member.objects.filter(instance_id=instance_id)
-        logging.debug('Members=', members)
-        serializer = MemberSerializer(members, many=True)
+        logger.debug('Members=%s', members)
+        serializer = MemberValuesSerializer(members, many=True)
         return Response(serializer.data)
 
     def post(self, request):
@@ -168,55 +260,68 @@ class MemberList(APIView):
         return Response(serializer.data)
 
 
-class MemberPointsHistory(APIView):
+class MemberPointsHistory(TenantShardMixin, APIView):
     """
-    Get all the given points a user received
+    Get all the given points a user received. The weeks compacted by compact_archived_points come first, with a single
+    row per week holding the points of all the givers and no from_member.
 
-    Endpoint: **/v1/member/history/<email>/?instance_id=1234**
+    Endpoint: **/v1/member/history/<email>/?instance_id=1234&from_week=YYYY-MM-DD&to_week=YYYY-MM-DD**
 
     Methods: *GET*
     """
+    replica_read = True
+    query_budget = {'get': 4}
+
     @staticmethod
-    def get_given_points_member(member, instance_id):
+    def get_given_points_member(member, instance_id, week_range):
         try:
-            return GivenPointArchived.objects.filter(to_member=member, instance_id=instance_id)
+            return GivenPointArchived.objects.filter(to_member=member, instance_id=instance_id, **week_range)
         except GivenPointArchived.DoesNotExist:
             raise Http404
 
+    @method_decorator(condition(etag_func=tenant_etag))
     def get(self, request, email):
         instance_id = request.GET.get('instance_id', '')
         member = get_member(email, instance_id)
-        given_points = self.get_given_points_member(member, instance_id)
-        serializer = GivenPointArchivedSerializer(given_points, many=True)
-        return Response(serializer.data)
+        week_range = get_week_range(request)
+        summaries = GivenPointArchivedSummary.objects.filter(to_member=member, instance_id=instance_id, **week_range)
+        given_points = self.get_given_points_member(member, instance_id, week_range)
+        return Response(GivenPointArchivedSummaryValuesSerializer(summaries.order_by('week'), many=True).data +
+                        GivenPointArchivedValuesSerializer(given_points, many=True).data)
 
 
-class GivenPointsTeamTotal(APIView):
+class GivenPointsTeamTotal(TenantShardMixin, APIView):
     """
     Get all the past point distributions
 
-    Endpoint: **/v1/team/points/?instance_id=1234**
+    Endpoint: **/v1/team/points/?instance_id=1234&from_week=YYYY-MM-DD&to_week=YYYY-MM-DD**
 
     Methods: *GET*
     """
+    replica_read = True
+    query_budget = {'get': 4}
+
     @staticmethod
-    def get_aggregate(instance_id, members_list):
+    def get_aggregate(instance_id, members_list, week_range):
+        # The archived points and the weeks compacted out of them
+        totals = {}
+        for model in (GivenPointArchived, GivenPointArchivedSummary):
+            for member_id, points in model.objects.filter(instance_id=instance_id, **week_range).order_by()\
+                    .values('to_member').annotate(sum=Sum('points')).values_list('to_member', 'sum'):
+                totals[member_id] = totals.get(member_id, 0) + points
         members_to_total_points = {}
-        for member in members_list:
-            identifier = member.identifier
-            name = member.name
-            sum_points = GivenPointArchived.objects.filter(to_member=identifier, instance_id=instance_id)\
-                .aggregate(sum=Sum('points'))
-            members_to_total_points[name] = (sum_points['sum'] if sum_points['sum'] is not None else 0)
+        for member_id, name in members_list.values_list('id', 'name'):
+            members_to_total_points[name] = totals.get(member_id, 0)
         return members_to_total_points
 
+    @method_decorator(condition(etag_func=tenant_etag))
     def get(self, request):
         instance_id = request.GET.get('instance_id', '')
         members_list = get_all_members(instance_id)
-        return Response(self.get_aggregate(instance_id, members_list))
+        return Response(self.get_aggregate(instance_id, members_list, get_week_range(request)))
 
 
-class PointDistributionHistory(APIView):
+class PointDistributionHistory(TenantShardMixin, APIView):
     """
     Get all the past point distributions
 
@@ -224,16 +329,21 @@ class PointDistributionHistory(APIView):
 
     Methods: *GET*
     """
+    replica_read = True
+    query_budget = {'get': 3}
+
+    @method_decorator(condition(etag_func=tenant_etag))
     def get(self, request):
         instance_id = request.GET.get('instance_id', '')
         point_distribution_history = filter_final_points_distributions(instance_id)
-        serializer = PointDistributionSerializer(point_distribution_history, many=True)
+        serializer = PointDistributionValuesSerializer(point_distribution_history, many=True)
         return Response(serializer.data)
 
 
-class SendPoints(APIView):
+class SendPoints(TenantShardMixin, APIView):
     """
-    Send points to team members. Date must be the current week
+    Send points to team members. Date must be the current week. A request sent again with the same Idempotency-Key
+    header gets the response of the first one
 
     Endpoint: **/v1/points/distribution/send**
 
@@ -262,24 +372,91 @@ class SendPoints(APIView):
     }
     ```
     """
+    query_budget = {'post': 11, 'put': 9}
+
     @staticmethod
     def get_or_create_point_distribution(date, week, instance_id, identifier):
-        obj, _ = PointDistribution.objects.get_or_create(instance_id=instance_id, week=week, is_final=False,
-                                                         identifier=identifier, defaults={'date': date})
+        """
+        Get and lock the distribution of the week. It is the only row every write path locks explicitly, and always
+        first, so concurrent submissions of a week queue on it instead of racing.
+        """
+        obj, _ = PointDistribution.objects.select_for_update().get_or_create(
+            identifier=identifier, defaults={'instance_id': instance_id, 'week': week, 'date': date, 'is_final': False})
+        if obj.is_final:
+            raise FinalPointDistributionException()
         return obj
 
+    @staticmethod
+    def get_distribution_data(point_distribution, members):
+        """
+        Representation of the distribution with the emails of the members instead of their identifiers
+        """
+        data = PointDistributionValuesSerializer(PointDistribution.objects.filter(pk=point_distribution.pk)).data
+        emails = dict((member.identifier, member.email) for member in members.values())
+        for given_point in data['given_points']:
+            given_point['to_member'] = emails[given_point['to_member']]
+            given_point['from_member'] = emails[given_point['from_member']]
+        return data
+
+    @staticmethod
+    def notify_slackbot(given_points, members):
+        for given_point in given_points:
+            from_member = given_point['from_member']
+            to_member = given_point['to_member']
+            instance_id = given_point['instance_id']
+            point = given_point['points']
+            from_member_real_name = members[from_member].name if from_member in members else from_member
+            to_member_real_name = members[to_member].name if to_member in members else to_member
+
+            msg = '{} gave {} {} points'.format(from_member_real_name, to_member_real_name, point)
+            logger.info("Created message=%s", msg)
+            data = {"instance_id": instance_id, "user_email": from_member, "msg": msg}
+            send_to_slackbot(data)
+
+    def submit_points(self, data, date, week, instance_id, members):
+        point_distribution = self.get_or_create_point_distribution(date, week, instance_id, data['identifier'])
+        context = {'members': dict((member.identifier, member) for member in members.values())}
+        serializer = PointDistributionSerializer(point_distribution, data=data, context=context)
+        if serializer.is_valid():
+            try:
+                serializer.save()
+            except IntegrityError:
+                raise PointsAlreadySentException()
+        return serializer
+
+    def update_points(self, given_points, date, week, instance_id, identifier, members):
+        point_distribution = self.get_or_create_point_distribution(date, week, instance_id, identifier)
+        given_points_models = get_given_point_models(given_points, week, instance_id)
+        context = {'members': dict((member.identifier, member) for member in members.values())}
+        points = OrderedDict()
+        for idx, model in enumerate(given_points_models):
+            given_point = dict(given_points[idx])
+            given_point['from_member'] = concatenate_and_hash(given_point['from_member'], instance_id)
+            given_point['to_member'] = concatenate_and_hash(given_point['to_member'], instance_id)
+            given_point['week'] = week
+            serializer = GivenPointSerializer(model, data=given_point, context=context)
+            if not serializer.is_valid():
+                return point_distribution, serializer.errors
+            points[model.pk] = serializer.validated_data['points']
+        if points:
+            # A single UPDATE for all the points of the request
+            GivenPoint.objects.filter(pk__in=list(points)).update(points=Case(
+                *[When(pk=pk, then=Value(value)) for pk, value in points.items()], output_field=IntegerField()))
+            record_tenant_change(instance_id)
+        return point_distribution, None
+
+    @idempotent
     def post(self, request):
-        print(request.data)
+        logger.debug("Received points distribution %s", request.data)
         date = request.data['date']
         instance_id = request.data['instance_id']
         if not is_current_week(date, DATE_PATTERN):
             raise NotCurrentWeekException()
         week = get_monday_from_date(date, DATE_PATTERN)
         request.data['identifier'] = concatenate_and_hash(week, instance_id)
-        point_distribution = self.get_or_create_point_distribution(date, week, instance_id, request.data['identifier'])
-        members_set = set(get_all_members(instance_id).values_list('email', flat=True))
+        members = get_members_by_email(instance_id)
         given_points = request.data['given_points']
-        check_batch_includes_all_members(given_points, members_set)
+        check_batch_includes_all_members(given_points, set(members))
         check_all_point_values_are_valid(given_points)
         request.data['week'] = week
 
@@ -288,47 +465,19 @@ class SendPoints(APIView):
             given_point['to_member'] = concatenate_and_hash(given_point['to_member'], instance_id)
             given_point['from_member'] = concatenate_and_hash(given_point['from_member'], instance_id)
 
-        serializer = PointDistributionSerializer(point_distribution, data=request.data)
+        serializer = run_in_transaction(self.submit_points, request.data, date, week, instance_id, members)
 
-        if not serializer.is_valid():
+        if serializer.errors:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
 
-        for given_point in serializer.data['given_points']:
-            given_point['to_member'] = Member.objects.get(identifier=given_point['to_member']).email
-            given_point['from_member'] = Member.objects.get(identifier=given_point['from_member']).email
+        data = self.get_distribution_data(serializer.instance, members)
 
         # Going through to send message to slackbot
-        for given_point in serializer.data['given_points']:
-            from_member = given_point['from_member']
-            to_member = given_point['to_member']
-            instance_id = given_point['instance_id']
-            point = given_point['points']
-
-            try:
-                from_member_real_name = Member.objects.get(instance_id=instance_id, email=from_member).name
-
-            except Member.DoesNotExist:
-                from_member_real_name = from_member
+        self.notify_slackbot(data['given_points'], members)
 
-            try:
-                to_member_real_name = Member.objects.get(instance_id=instance_id, email=to_member).name
-
-            except Member.DoesNotExist:
-                to_member_real_name = to_member
-
-            msg = '{} gave {} {} points'.format(from_member_real_name, to_member_real_name, point)
-            logging.info("Created message={}".format(msg))
-            data = {"instance_id": instance_id, "user_email": from_member, "msg": msg}
-            print(data)
-            slackbot_response = requests.post(SLACKBOT_URL + 'v1/api/send/', data=data)
-            if slackbot_response.status_code == 202:
-                logging.info("Successfully submitted to slack channel")
-            else:
-                logging.warn("Failed to submit messages to slack channel, status_code={}".format(slackbot_response.status_code))
-
-        return Response(serializer.data)
+        return Response(data)
 
+    @idempotent
     def put(self, request):
         date = request.data['date']
         instance_id = request.data['instance_id']
@@ -338,52 +487,189 @@ class SendPoints(APIView):
         check_all_point_values_are_valid(given_points)
         week = get_monday_from_date(date, DATE_PATTERN)
         request.data['identifier'] = concatenate_and_hash(week, instance_id)
-        given_points_models = get_given_point_models(given_points, week, instance_id)
-        for idx, model in enumerate(given_points_models):
-            given_points[idx]['from_member'] = concatenate_and_hash(given_points[idx]['from_member'], instance_id)
-            given_points[idx]['to_member'] = concatenate_and_hash(given_points[idx]['to_member'], instance_id)
-            given_points[idx]['week'] = week
-            serializer = GivenPointSerializer(model, data=given_points[idx])
-            if not serializer.is_valid():
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            serializer.save()
-        point_distribution = self.get_or_create_point_distribution(date, week, instance_id, request.data['identifier'])
-        serializer = PointDistributionSerializer(point_distribution)
-        for given_point in serializer.data['given_points']:
-            given_point['to_member'] = Member.objects.get(identifier=given_point['to_member']).email
-            given_point['from_member'] = Member.objects.get(identifier=given_point['from_member']).email
+        members = get_members_by_email(instance_id)
+        point_distribution, errors = run_in_transaction(self.update_points, given_points, date, week, instance_id,
+                                                        request.data['identifier'], members)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        data = self.get_distribution_data(point_distribution, members)
 
         # Going through to send message to slackbot
-        for given_point in request.data['given_points']:
-            from_member = given_point['from_member']
-            to_member = given_point['to_member']
-            instance_id = given_point['instance_id']
-            point = given_point['points']
+        self.notify_slackbot(given_points, members)
 
-            try:
-                from_member_real_name = Member.objects.filter(instance_id=instance_id, email=from_member)
+        return Response(data)
 
-            except Member.DoesNotExist:
-                from_member_real_name = from_member
 
-            try:
-                to_member_real_name = Member.objects.filter(instance_id=instance_id, email=to_member)
+class SendPointsBatch(APIView):
+    """
+    Send the points of several members, of one or more teams, in one request. Every distribution is checked as
+    SendPoints does before anything is written, the valid ones are then written in one transaction per team. The
+    results follow the order of the distributions, each with its status and the points sent or the error.
 
-            except Member.DoesNotExist:
-                to_member_real_name = to_member
+    Endpoint: **/v1/points/distribution/send/batch/**
 
-            msg = '{} gave {} {} points'.format(from_member_real_name, to_member_real_name, point)
-            data = {'instance_id': instance_id, 'user_email': from_member, 'msg': msg}
-            slackbot_response = requests.post(SLACKBOT_URL + 'v1/api/send/', data=data)
-            if slackbot_response.status_code == 202:
-                logging.info("Successfully submitted to slack channel")
+    Methods: *POST*
+
+    Body:
+
+    ```
+    {
+        "distributions": [
+            {
+                "given_points": [
+                    {
+                        "to_member": "member1@email.com",
+                        "points": 100,
+                        "from_member": "me@me.com",
+                        "instance_id": "1234"
+                    }
+                ],
+                "date": "2017-01-21",
+                "instance_id": "1234"
+            }
+        ]
+    }
+    ```
+    """
+    query_budget = {'post': 0}
+    # Added for every team of the batch
+    tenant_query_budget = {'post': 9}
+
+    @staticmethod
+    def check_distribution(distribution, members):
+        """
+        Validated given points of a distribution, with the members looked up
+        """
+        try:
+            date = distribution['date']
+            instance_id = distribution['instance_id']
+            given_points = list(distribution['given_points'])
+            if not is_current_week(date, DATE_PATTERN):
+                raise NotCurrentWeekException()
+            check_batch_includes_all_members(given_points, set(members))
+            check_all_point_values_are_valid(given_points)
+            week = get_monday_from_date(date, DATE_PATTERN)
+            data = [dict(given_point, week=week, instance_id=instance_id,
+                         from_member=concatenate_and_hash(given_point['from_member'], instance_id),
+                         to_member=concatenate_and_hash(given_point['to_member'], instance_id))
+                    for given_point in given_points]
+        except (KeyError, TypeError, ValueError):
+            raise InvalidBatchException()
+        context = {'members': dict((member.identifier, member) for member in members.values())}
+        serializer = GivenPointSerializer(data=data, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @staticmethod
+    def get_result(given_points):
+        return OrderedDict([
+            ('status', status.HTTP_200_OK),
+            ('given_points', [OrderedDict([
+                ('to_member', given_point['to_member'].email),
+                ('points', given_point['points']),
+                ('from_member', given_point['from_member'].email),
+                ('week', given_point['week']),
+                ('instance_id', given_point['instance_id']),
+            ]) for given_point in given_points]),
+        ])
+
+    @staticmethod
+    def get_error(exception):
+        return OrderedDict([('status', exception.status_code), ('detail', exception.detail)])
+
+    def submit_points(self, instance_id, pending):
+        """
+        Write the checked distributions of a team, those whose members already sent their points this week are
+        left out
+        """
+        results = {}
+        # Only distributions of the current week get here
+        date, week = pending[0][1], pending[0][2]
+        identifier = concatenate_and_hash(week, instance_id)
+        try:
+            point_distribution = SendPoints.get_or_create_point_distribution(date, week, instance_id, identifier)
+        except FinalPointDistributionException as e:
+            return dict((index, self.get_error(e)) for index, _, _, _ in pending)
+
+        sent = set(GivenPoint.objects.filter(point_distribution=point_distribution, from_member__isnull=False)
+                   .values_list('from_member', flat=True).distinct())
+        rows = []
+        for index, _, _, given_points in pending:
+            from_members = set(given_point['from_member'].pk for given_point in given_points)
+            if from_members & sent:
+                results[index] = self.get_error(PointsAlreadySentException())
+                continue
+            sent |= from_members
+            rows.extend(GivenPoint(point_distribution=point_distribution, **given_point)
+                        for given_point in given_points)
+            results[index] = self.get_result(given_points)
+        if rows:
+            with batched_version_bumps():
+                GivenPoint.objects.bulk_create(rows)
+                # bulk_create sends no post_save, saving the distribution invalidates the ETags of the tenant
+                point_distribution.save()
+        return results
+
+    @idempotent
+    def post(self, request):
+        distributions = request.data.get('distributions') if hasattr(request.data, 'get') else None
+        if not isinstance(distributions, list):
+            raise InvalidBatchException()
+
+        results = [None] * len(distributions)
+        tenants = OrderedDict()
+        for index, distribution in enumerate(distributions):
+            instance_id = distribution.get('instance_id', '') if isinstance(distribution, dict) else ''
+            if not isinstance(instance_id, str) or instance_id == '':
+                results[index] = self.get_error(InvalidBatchException())
             else:
-                logging.warn("Failed to submit messages to slack channel")
+                tenants.setdefault(instance_id, []).append(index)
+        request._request.tenants_count = len(tenants)
+
+        # Everything is checked before the first write
+        checked = OrderedDict()
+        for instance_id, indexes in tenants.items():
+            shard = get_tenant_shard(instance_id, create=True)
+            if shard is not None and shard.is_locked:
+                for index in indexes:
+                    results[index] = self.get_error(TenantLockedException())
+                continue
+            database = shard.database if shard is not None else None
+            set_tenant_database(database)
+            try:
+                members = get_members_by_email(instance_id)
+            finally:
+                set_tenant_database(None)
+            pending = []
+            for index in indexes:
+                try:
+                    given_points = self.check_distribution(distributions[index], members)
+                except APIException as e:
+                    results[index] = self.get_error(e)
+                    continue
+                date = distributions[index]['date']
+                pending.append((index, date, get_monday_from_date(date, DATE_PATTERN), given_points))
+            if pending:
+                checked[instance_id] = (database, members, pending)
 
-        return Response(serializer.data)
+        for instance_id, (database, members, pending) in checked.items():
+            set_tenant_database(database)
+            try:
+                written = run_in_transaction(self.submit_points, instance_id, pending)
+            except IntegrityError:
+                # Points of the same members were sent concurrently
+                written = dict((index, self.get_error(PointsAlreadySentException())) for index, _, _, _ in pending)
+            finally:
+                set_tenant_database(None)
+            for index, result in written.items():
+                results[index] = result
+                if result['status'] == status.HTTP_200_OK:
+                    SendPoints.notify_slackbot(result['given_points'], members)
+
+        return Response({'results': results})
 
 
-class PointDistributionWeek(APIView):
+class PointDistributionWeek(TenantShardMixin, APIView):
     """
     Get a point distribution of a past week
 
@@ -391,23 +677,23 @@ class PointDistributionWeek(APIView):
 
     Methods: *GET*
     """
-    @staticmethod
-    def get_object(week, instance_id):
-        try:
-            return PointDistribution.objects.get(instance_id=instance_id, week=week)
-        except PointDistribution.DoesNotExist:
-            raise Http404
+    replica_read = True
+    query_budget = {'get': 3}
 
+    @method_decorator(condition(etag_func=tenant_etag))
     def get(self, request, week):
         instance_id = request.GET.get('instance_id', '')
-        point_distribution = self.get_object(week, instance_id)
-        serializer = PointDistributionSerializer(point_distribution)
-        return Response(serializer.data)
+        point_distribution = PointDistribution.objects.filter(instance_id=instance_id, week=week)
+        try:
+            return Response(PointDistributionValuesSerializer(point_distribution).data)
+        except PointDistribution.DoesNotExist:
+            raise Http404
 
 
-class ValidateProvisionalPointDistribution(APIView):
+class ValidateProvisionalPointDistribution(TenantShardMixin, APIView):
     """
-    Validate a point distribution
+    Validate a point distribution. A request sent again with the same Idempotency-Key header gets the response of the
+    first one
 
     Endpoint: **/v1/point/distribution/validate**
 
@@ -417,30 +703,80 @@ class ValidateProvisionalPointDistribution(APIView):
 
     `{"week":"YYYY-MM-DD", "instance_id":"1234"}`
     """
+    query_budget = {'put': 14}
+
     @staticmethod
     def get_point_distribution(week, instance_id):
         try:
-            return PointDistribution.objects.get(week=week, instance_id=instance_id)
+            return PointDistribution.objects.select_for_update().get(week=week, instance_id=instance_id)
         except PointDistribution.DoesNotExist:
             raise Http404
 
+    def validate(self, week, instance_id):
+        point_distribution = self.get_point_distribution(week, instance_id)
+        members_set = set(get_all_members(instance_id))
+        with batched_version_bumps():
+            validate_provisional_point_distribution(point_distribution, members_set)
+            point_distribution.is_final = True
+            point_distribution.save()
+        return point_distribution
+
+    @idempotent
     def put(self, request):
         week = request.data['week']
         instance_id = request.data['instance_id']
-        point_distribution = self.get_point_distribution(week, instance_id)
-        members_set = set(get_all_members(instance_id))
-        validate_provisional_point_distribution(point_distribution, members_set)
-        point_distribution.is_final = True
-        point_distribution.save()
-        serializer = PointDistributionSerializer(point_distribution)
+        point_distribution = run_in_transaction(self.validate, week, instance_id)
+        serializer = PointDistributionValuesSerializer(PointDistribution.objects.filter(pk=point_distribution.pk))
         return Response(serializer.data)
 
 
-@api_view(['DELETE'])
-def reset_database(request):
-    Member.objects.all().delete()
-    GivenPoint.objects.all().delete()
-    PointDistribution.objects.all().delete()
-    GivenPointArchived.objects.all().delete()
+class PurgeTeam(TenantShardMixin, APIView):
+    """
+    Delete all the data of a team, or of every team when no instance_id is given and PURGE_TRUNCATE_ENABLED is set
+    (test environments), staff users only
+
+    Endpoint: **/v1/teams/purge/?instance_id=1234**
+
+    Methods: *DELETE*
+    """
+    permission_classes = (IsAdminUser,)
+    query_budget = {'delete': 12}
+
+    def delete(self, request):
+        instance_id = request.query_params.get('instance_id', '')
+        if instance_id == '':
+            if not settings.PURGE_TRUNCATE_ENABLED:
+                raise TruncateDisabledException()
+            purge.truncate_all()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        deleted = purge.purge_tenant(instance_id, get_tenant_database() or DEFAULT_DB_ALIAS)
+        return Response(OrderedDict([('instance_id', instance_id), ('deleted', deleted)]))
+
+
+def prometheus_metrics(request):
+    """
+    Request metrics in the Prometheus text format
 
-    return Response(data="Clear database from database", status=status.HTTP_200_OK)
\ No newline at end of file
+    Endpoint: **/metrics**
+    """
+    from prometheus_client import CONTENT_TYPE_LATEST
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE_LATEST)
+
+
+class ProfileList(APIView):
+    """
+    Latest request profiles with their top functions by cumulative time, staff users only
+    Endpoint: **/profiles/?limit=20&top=10**
+    """
+    permission_classes = (IsAdminUser,)
+    query_budget = {'get': 2}
+
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', '20'))
+            top = int(request.GET.get('top', '10'))
+        except ValueError:
+            raise InvalidProfileQueryException()
+        if limit < 0 or top < 0:
+            raise InvalidProfileQueryException()
+        return Response(profiling.list_profiles(limit, top))
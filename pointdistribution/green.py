@@ -0,0 +1,14 @@
+"""
+WSGI config for serving pointdistribution with gevent workers.
+
+Most of the time of the member and point submission endpoints is spent waiting on VSTS, the token storage and
+Slackbot. Served with ``gunicorn pointdistribution.green -k gevent --worker-connections 1000`` every request runs in
+a greenlet, so a worker keeps serving other requests while one waits on the network or on PostgreSQL.
+"""
+
+from psycogreen.gevent import patch_psycopg
+
+# The gevent worker patches the standard library, psycopg2 needs its own wait callback
+patch_psycopg()
+
+from .wsgi import application  # noqa: E402,F401
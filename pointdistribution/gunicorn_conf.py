@@ -0,0 +1,85 @@
+"""
+Gunicorn config for pointdistribution.
+
+``gunicorn -c pointdistribution/gunicorn_conf.py pointdistribution.wsgi``
+
+The workers are sized from the cores available to the container and GUNICORN_WORKLOAD:
+
+- ``cpu``: sync workers, two per core plus one
+- ``mixed``: threaded workers, one per core plus one, each with GUNICORN_THREADS threads
+- ``io``: gevent workers, one per core, each with up to GUNICORN_WORKER_CONNECTIONS requests in flight
+
+Without the outbound endpoints (OUTBOUND_ENDPOINTS=False) nothing waits on VSTS or Slackbot and the sync workers are
+used whatever the workload. WEB_CONCURRENCY and GUNICORN_WORKER_CLASS override the computed values.
+"""
+
+import os
+
+
+def get_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def has_gevent():
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_profile(cores, workload, outbound_endpoints, green=True):
+    """
+    Worker class, number of workers and threads for the given cores and workload
+    """
+    if workload == 'cpu' or not outbound_endpoints:
+        return 'sync', 2 * cores + 1, 1
+    if workload == 'io':
+        if green:
+            return 'gevent', cores, 1
+        return 'gthread', cores + 1, 16
+    return 'gthread', cores + 1, int(os.getenv('GUNICORN_THREADS', '4'))
+
+
+worker_class, workers, threads = get_profile(get_cores(), os.getenv('GUNICORN_WORKLOAD', 'mixed'),
+                                             eval(os.getenv('OUTBOUND_ENDPOINTS', 'True')), has_gevent())
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', worker_class)
+workers = int(os.getenv('WEB_CONCURRENCY', workers))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', '8000'))
+
+# Connections from the load balancer are reused between requests (ignored by the sync workers)
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Workers are recycled to bound memory growth, the jitter keeps them from restarting all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = timeout
+
+# The app is loaded once in the master and shared copy-on-write by the workers. The gevent workers load it after
+# patching instead, the thread locals of the tenant routing have to be created per greenlet.
+preload_app = worker_class != 'gevent'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def worker_exit(server, worker):
+    # A worker recycled after max_requests or stopped still sends the Slackbot notifications it queued, within the
+    # graceful timeout
+    from core import outbound
+    outbound.drain()
+
+
+def child_exit(server, worker):
+    if 'prometheus_multiproc_dir' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
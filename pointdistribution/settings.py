@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import tempfile
+
+from corsheaders.defaults import default_headers as default_cors_headers
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,74 +42,88 @@ ALLOWED_HOSTS = [
 SLACKBOT_URL = os.getenv('SLACKBOT_URL', 'https://discovery-slackbot.azurewebsites.net/')
 
 # Logging configuration
+# Records are written as JSON lines by a background thread, requests never wait on stdout. Only LOG_SAMPLE_RATE of the
+# debug and info records are kept, warnings and errors always are.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1' if PROD else '1'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': True,
     'filters': {
-        'require_debug_false': {
-            '()': 'django.utils.log.RequireDebugFalse',
-        },
-        'require_debug_true': {
-            '()': 'django.utils.log.RequireDebugTrue',
+        'sample': {
+            '()': 'core.log.SamplingFilter',
+            'rate': LOG_SAMPLE_RATE,
         },
     },
     'formatters': {
-        'simple': {
-            'format': '[%(asctime)s] %(levelname)s %(message)s',
-            'datefmt': '%Y-%m-%d %H:%M:%S'
-        },
-        'verbose': {
-            'format': '[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s',
-            'datefmt': '%Y-%m-%d %H:%M:%S'
+        'json': {
+            '()': 'core.log.JSONFormatter',
         },
     },
     'handlers': {
-        'console': {
-            'level': 'INFO',
-            'filters': ['require_debug_false'],
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple'
-        },
-        'development_logfile': {
-            'level': 'DEBUG',
-            'filters': ['require_debug_true'],
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose'
-        },
-        'production_logfile': {
-            'level': 'ERROR',
-            'filters': ['require_debug_false'],
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple'
+        'background': {
+            'level': LOG_LEVEL,
+            'filters': ['sample'],
+            'class': 'core.log.BackgroundHandler',
+            'formatter': 'json'
         },
     },
+    'root': {
+        'handlers': ['background'],
+        'level': LOG_LEVEL,
+    },
     'loggers': {
         'django': {
-            'handlers': ['console', 'development_logfile', 'production_logfile'],
+            'handlers': ['background'],
+            'level': 'INFO',
+            'propagate': False,
         },
         'py.warnings': {
-            'handlers': ['console', 'development_logfile'],
+            'handlers': ['background'],
+            'propagate': False,
+        },
+        # A line per outbound connection otherwise
+        'requests.packages.urllib3': {
+            'level': 'WARNING',
+        },
+        'urllib3': {
+            'level': 'WARNING',
         },
     }
 }
 
 # Application definition
 
+# The admin and the API docs are only loaded where they are used, production starts faster without the docs
+ENABLE_ADMIN = eval(os.getenv('ENABLE_ADMIN', 'True'))
+ENABLE_DOCS = eval(os.getenv('ENABLE_DOCS', str(not PROD)))
+
+# manage.py benchmark_startup fails when loading the app takes longer
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', '2'))
+
 INSTALLED_APPS = [
     'core.apps.CoreConfig',
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework_docs',
     'corsheaders',
 ]
 
+if ENABLE_ADMIN:
+    INSTALLED_APPS.append('django.contrib.admin')
+
+if ENABLE_DOCS:
+    INSTALLED_APPS.append('rest_framework_docs')
+
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -171,6 +188,43 @@ else:
         }
     }
 
+# Tenant shards
+# Every shard holds the core tables of a subset of the tenants, the default database also holds the shard map
+
+DB_SHARDS = int(os.getenv('DB_SHARDS', '0'))
+
+for shard in range(1, DB_SHARDS + 1):
+    alias = 'shard_{}'.format(shard)
+    DATABASES[alias] = dict(DATABASES['default'])
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['NAME'] = os.path.join(BASE_DIR, 'db_{}.sqlite3'.format(alias))
+    else:
+        DATABASES[alias]['NAME'] = '{}_{}'.format(DATABASES['default']['NAME'], alias)
+
+TENANT_SHARDS = sorted(DATABASES.keys())
+
+# Read replicas
+# Every PostgreSQL database gets one replica per host of DB_REPLICA_HOSTS, with the same name and credentials
+
+DB_REPLICA_HOSTS = [host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host != '']
+DATABASE_REPLICAS = {}
+
+for alias in TENANT_SHARDS:
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        continue
+    for index, host in enumerate(DB_REPLICA_HOSTS, 1):
+        replica = '{}_replica_{}'.format(alias, index)
+        DATABASES[replica] = dict(DATABASES[alias], HOST=host, TEST={'MIRROR': alias})
+        DATABASE_REPLICAS.setdefault(alias, []).append(replica)
+
+# Replicas further behind than this are removed from the rotation until they catch up
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '10'))
+# Reads of a tenant stay on the primary for this long after one of its writes
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '15'))
+
+DATABASE_ROUTERS = ['core.routers.TenantShardRouter']
+
 # Rest framework
 # http://www.django-rest-framework.org/
 
@@ -180,7 +234,20 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         #'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
-    'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler'
+    'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
+    # orjson is used when installed, otherwise the standard library. JSON stays the default, clients can ask for
+    # MessagePack with Accept: application/msgpack and send it with Content-Type: application/msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'core.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'core.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # Password validation
@@ -222,6 +289,47 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_ALLOW_HEADERS = default_cors_headers + ('idempotency-key',)
+
+# Response compression, brotli is used when installed and preferred by the client
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+
+# Profiling of single requests, asked for with the X-Profile-Token header (manage.py profile_token) or sampled. The
+# latest PROFILING_MAX_FILES profiles are kept in PROFILING_DIR and listed by /profiles/ to the staff users.
+PROFILING_ENABLED = eval(os.getenv('PROFILING_ENABLED', 'False'))
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', '3600'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'pointdistribution-profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '50'))
+
+# manage.py compact_archived_points keeps only the weekly totals of each member for the archived points older than this
+ARCHIVE_RETENTION_WEEKS = int(os.getenv('ARCHIVE_RETENTION_WEEKS', '52'))
+
+# DELETE /v1/teams/purge/ without an instance_id empties the tables of every team
+PURGE_TRUNCATE_ENABLED = eval(os.getenv('PURGE_TRUNCATE_ENABLED', str(not PROD)))
+
+# Responses stored for an Idempotency-Key are replayed for this long
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+# A key whose first request has not answered after this long, longer than GUNICORN_TIMEOUT, is taken over by a retry
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60'))
+
+# Concurrent outbound calls (VSTS, tokenstorage, Slackbot) per worker process
+OUTBOUND_MAX_WORKERS = int(os.getenv('OUTBOUND_MAX_WORKERS', '16'))
+
+# Connection pool and timeouts in seconds of every dependency
+OUTBOUND_DEPENDENCIES = {
+    'tokenstorage': {'pool_size': 10, 'connect_timeout': 3.05,
+                     'read_timeout': float(os.getenv('TOKENSTORAGE_READ_TIMEOUT', '5'))},
+    'vsts': {'pool_size': 16, 'connect_timeout': 3.05, 'read_timeout': float(os.getenv('VSTS_READ_TIMEOUT', '15'))},
+    'slackbot': {'pool_size': 10, 'connect_timeout': 3.05,
+                 'read_timeout': float(os.getenv('SLACKBOT_READ_TIMEOUT', '5'))},
+}
+
+# A dependency failing this many times in a row is not called for OUTBOUND_BREAKER_RESET_SECONDS
+OUTBOUND_BREAKER_FAILURES = int(os.getenv('OUTBOUND_BREAKER_FAILURES', '5'))
+OUTBOUND_BREAKER_RESET_SECONDS = float(os.getenv('OUTBOUND_BREAKER_RESET_SECONDS', '30'))
 
 VSTS_BASE_URL = 'https://{}.visualstudio.com/DefaultCollection/_apis/projects?api-version=1.0'
 SETTING_MANAGE_BASE_URL = os.getenv('SETTING_MANAGE_BASE_URL', 'https://discovery-settingmanagement.azurewebsites.net/')
\ No newline at end of file
@@ -13,11 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.conf.urls import include, url
-from django.contrib import admin
+
+from core.views import prometheus_metrics, ProfileList
 
 urlpatterns = [
     url(r'^v1/', include('core.urls')),
-    url(r'^admin/', admin.site.urls),
-    url(r'^docs/', include('rest_framework_docs.urls')),
+    url(r'^metrics$', prometheus_metrics),
+    url(r'^profiles/$', ProfileList.as_view()),
 ]
+
+if settings.ENABLE_ADMIN:
+    from django.contrib import admin
+    urlpatterns.append(url(r'^admin/', admin.site.urls))
+
+if settings.ENABLE_DOCS:
+    urlpatterns.append(url(r'^docs/', include('rest_framework_docs.urls')))